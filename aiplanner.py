@@ -0,0 +1,204 @@
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from numpy import ndarray
+from chunkworld import ChunkedWorld
+from pathfinding import Pathfinder
+
+
+# turn planning for the factions nobody plays. every faction's plan is made from a read only snapshot of the map and
+# of the faction itself, so plans do not depend on each other and can be made in worker processes. the plans are then
+# carried out one faction at a time in faction order, so a seed always plays out the same way however many workers
+# there are; a move that fails or a build on a tile another faction built on earlier in the turn is dropped there
+#
+# a plan is a list of actions on the faction's units, by their position in Faction.units:
+#   ('move', unit, (x, y))
+#   ('build', unit, template name)
+
+pool = None
+pool_workers = 0
+
+# the map the workers plan on, in shared memory: (world map, pathfinder version, blocks, layout). it is shared once
+# and only replaced when the type or height layers change, so a turn only sends the small per faction states
+shared = None
+
+# in a worker process: the layout of the map it last attached to, and a Pathfinder over it
+worker_layout = None
+worker_pathfinder = None
+
+
+def get_pool(workers: int):
+    global pool, pool_workers
+
+    if pool is None or pool_workers != workers:
+        if pool is not None:
+            pool.shutdown()
+        pool = ProcessPoolExecutor(max_workers=workers)
+        pool_workers = workers
+
+    return pool
+
+
+def release_map():
+    global shared
+
+    if shared is not None:
+        for block in shared[2].values():
+            block.close()
+            block.unlink()
+        shared = None
+
+
+@atexit.register
+def shutdown():
+    global pool, pool_workers
+
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+        pool_workers = 0
+    release_map()
+
+
+def share_map(world_map):
+    global shared
+
+    version = world_map.pathfinder.version
+    if shared is not None and shared[0] is world_map and shared[1] == version:
+        return shared[3]
+
+    release_map()
+    blocks = {}
+    layout = {}
+    for name in ('type', 'height'):
+        values = world_map.get_layer(name)
+        blocks[name] = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        ndarray(values.shape, values.dtype, buffer=blocks[name].buf)[...] = values
+        layout[name] = (blocks[name].name, values.shape, values.dtype.str)
+
+    shared = (world_map, version, blocks, layout)
+    return layout
+
+
+class MapSnapshot:
+    # the type and height layers of a WorldMap, which is all a Pathfinder reads from it
+    world = None
+
+    def __init__(self, layers: dict):
+        height, width = layers['type'].shape
+        self.generation_dict = {'width': width, 'height': height}
+        self.layers = layers
+
+    def get_layer(self, name: str):
+        return self.layers[name]
+
+
+def attach_map(layout: dict):
+    # runs in a worker process; the pathfinder keeps flat lists of the layers, so the shared memory is only read once
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, shape, dtype) in layout.items()}
+    snapshot = MapSnapshot({name: ndarray(shape, dtype, buffer=blocks[name].buf)
+                            for name, (block_name, shape, dtype) in layout.items()})
+
+    try:
+        pathfinder = Pathfinder(snapshot)
+        pathfinder.get_grid(None)
+    finally:
+        # the views have to go before the shared memory can be closed
+        snapshot.layers.clear()
+        for block in blocks.values():
+            block.close()
+
+    return pathfinder
+
+
+def faction_state(world_map, faction, structures: set):
+    # plain values only, so the state can be sent to a worker. structures holds the tiles of every faction that
+    # have a structure; only those in reach of the faction's units are sent along
+    units = []
+    taken = []
+    for u in faction.units:
+        move_distance = max(u.data['move_distance'] - u.used_movement, 0)
+        constructs = [(c['name'], c['energy_cost'], c.get('pop_cap', 0)) for c in u.data.get('constructs', ())]
+        units.append((u.location.x, u.location.y, move_distance, u.data['terrain'], constructs))
+
+        # a path costs at least its straight line length, so nothing further away than move_distance can be reached
+        x = u.location.x
+        y = u.location.y
+        reach = int(move_distance) + 1
+        taken.extend(p for p in world_map.entity_index.positions_in_rect(x - reach, y - reach, x + reach + 1,
+                                                                        y + reach + 1)
+                     if p in structures)
+
+    return {'structures': taken, 'units': units, 'energy': faction.energy_balance(),
+            'population': faction.population, 'population_cap': faction.population_cap}
+
+
+def structure_tiles(world_map):
+    return {p for p, tile_entities in world_map.entity_index.items()
+            if any(e.data['type'] == 'structure' for e in tile_entities)}
+
+
+def choose_construct(constructs: list, energy: int, population: int, population_cap: int):
+    names = [c[0] for c in constructs]
+
+    if energy < 0 and 'Solar Array' in names:
+        return constructs[names.index('Solar Array')]
+    if population >= population_cap and 'Habitat' in names:
+        return constructs[names.index('Habitat')]
+    if 'Mine' in names:
+        return constructs[names.index('Mine')]
+    return constructs[0]
+
+
+def plan_faction(pathfinder: Pathfinder, state: dict):
+    # every unit heads for the closest tile in range that has no structure yet and builds there
+    actions = []
+    built = set(state['structures'])
+    energy = state['energy']
+    population_cap = state['population_cap']
+
+    for n, (x, y, move_distance, terrain, constructs) in enumerate(state['units']):
+        if move_distance <= 0:
+            continue
+
+        free = sorted((cost, py, px) for (px, py), cost in pathfinder.reachable((x, y), terrain, move_distance).items()
+                      if (px, py) not in built)
+        if len(free) == 0:
+            continue
+
+        cost, ty, tx = free[0]
+        if (tx, ty) != (x, y):
+            actions.append(('move', n, (tx, ty)))
+
+        if len(constructs) > 0:
+            name, energy_cost, pop_cap = choose_construct(constructs, energy, state['population'], population_cap)
+            actions.append(('build', n, name))
+            built.add((tx, ty))
+            energy -= energy_cost
+            population_cap += pop_cap
+
+    return actions
+
+
+def plan_in_worker(layout: dict, state: dict):
+    global worker_layout, worker_pathfinder
+
+    if worker_layout != layout:
+        worker_pathfinder = attach_map(layout)
+        worker_layout = layout
+
+    return plan_faction(worker_pathfinder, state)
+
+
+def plan_turns(world_map, factions: list, workers: int):
+    # a plan for every faction, in the same order
+    structures = structure_tiles(world_map)
+    states = [faction_state(world_map, f, structures) for f in factions]
+
+    # a chunked world is too big to share; its plans are made here, reading only the chunks around the units
+    if workers <= 1 or len(factions) <= 1 or isinstance(world_map.world, ChunkedWorld):
+        return [plan_faction(world_map.pathfinder, state) for state in states]
+
+    layout = share_map(world_map)
+    futures = [get_pool(workers).submit(plan_in_worker, layout, state) for state in states]
+    return [f.result() for f in futures]
@@ -5,8 +5,11 @@ from asciimatics.scene import Scene
 import voromap
 import game
 import entities
+import profiling
+import savegame
 import os
 import copy
+from numpy import full
 
 # TODO:
 # resize console on map regeneration
@@ -36,6 +39,7 @@ class InfoBar(widgets.Widget):
     def process_event(self, event):
         return event
 
+    @profiling.profiled('ui.InfoBar.update')
     def update(self, frame_no):
         player_faction = next((f for f in self._model.factions if f.is_player), self._model.factions[0])
         offset = 0
@@ -99,6 +103,7 @@ class ConsoleView(widgets.Widget):
     def required_height(self, offset, width):
         return self.height
 
+    @profiling.profiled('ui.ConsoleView.update')
     def update(self, frame_no):
         if self._has_focus is True:
             style = Screen.A_BOLD
@@ -132,9 +137,8 @@ class ConsoleView(widgets.Widget):
 
 class EntityView(widgets.Widget):
 
-    def __init__(self, entity_list, location, game_model):
+    def __init__(self, location, game_model):
         super(EntityView, self).__init__('Entities')
-        self._entity_list = entity_list
         self.location = location
         self._model = game_model
         self.selected_entity = entities.Entity(game_model.factions[0], self._model.world_map.selected_tile,
@@ -142,6 +146,7 @@ class EntityView(widgets.Widget):
 
         self._is_tab_stop = False
 
+    @profiling.profiled('ui.EntityView.update')
     def update(self, frame_no):
         if len(self.location.entities) > 0 and not self.location.entities.__contains__(self.selected_entity):
             self.selected_entity = self.location.entities[0]
@@ -158,7 +163,9 @@ class EntityView(widgets.Widget):
                                     self._x, self._y + line, colour=Screen.COLOUR_WHITE, attr=Screen.A_BOLD)
 
         line += 1
-        ci = vm.get_continent_of_tile(self.location).icon
+        # sea tiles belong to no continent
+        continent = vm.get_continent_of_tile(self.location)
+        ci = '-' if continent is None else continent.icon
         self._frame.canvas.print_at(f'Region: {self.location.icon}, '
                                     f'Continent: {ci}',
                                     self._x, self._y + line, colour=Screen.COLOUR_WHITE, attr=Screen.A_BOLD)
@@ -184,7 +191,8 @@ class EntityView(widgets.Widget):
         if self._model.world_map.is_anchored:
             temp_list.append(self._model.world_map.selected_entity)
         else:
-            temp_list = self._entity_list
+            # read from the tile every time; the turn may have moved or built things there since the last frame
+            temp_list = self.location.entities
 
         for e in temp_list:
             color = e.owner.color
@@ -212,7 +220,6 @@ class EntityView(widgets.Widget):
     def reset(self):
         self.selected_entity = entities.Entity(self._model.factions[0], self._model.world_map.selected_tile,
                                                {'name': '', 'icon': '/', 'type': 'entity', 'cost': 0, 'upkeep': 0})
-        self._entity_list = []
 
     def process_event(self, event):
         if isinstance(event, asciimatics.event.KeyboardEvent):
@@ -242,6 +249,8 @@ class EntityView(widgets.Widget):
                     return None
 
                 self.selected_entity.handle_abilities(event)
+                # abilities may have built something on the tile
+                self._model.world_map.mark_dirty(self.location)
 
         return event
 
@@ -254,7 +263,7 @@ class EntityView(widgets.Widget):
         self._value = new_value
 
     def required_height(self, offset, width):
-        return len(self._entity_list) * 8
+        return len(self.location.entities) * 8
 
 
 class VoromapView(widgets.Widget):
@@ -275,6 +284,16 @@ class VoromapView(widgets.Widget):
 
         self.reduce_cpu = True
 
+        self.redraw_all = True
+        self.drawn_focus = False
+
+        # cached two cell look of every tile in window, the part of the map the canvas shows, as
+        # (height, width * 2); huge chunked worlds are only ever generated and cached as far as they are seen
+        self.window = None
+        self.glyphs = None
+        self.foregrounds = None
+        self.backgrounds = None
+
     @property
     def value(self):
         return self._value
@@ -285,86 +304,173 @@ class VoromapView(widgets.Widget):
 
     def reset(self):
         self.world_map.generation_dict = self.generation_dict_backup
+        self.redraw_all = True
 
         return None
 
+    @profiling.profiled('ui.VoromapView.update')
     def update(self, frame_no):
+        # the frame leaves the map cells alone between frames (see GameView._clear), so only tiles that changed since
+        # the last frame are painted again
+        redraw_all, dirty = self.world_map.take_dirty()
+
+        # the selected tile is drawn differently with and without focus
+        if self._has_focus != self.drawn_focus:
+            self.drawn_focus = self._has_focus
+            dirty.add((self.world_map.selected_tile.x, self.world_map.selected_tile.y))
+
+        window = self.visible_window()
+        if redraw_all or self.redraw_all or self.glyphs is None or window != self.window:
+            self.redraw_all = False
+            self.window = window
+            self.render_tiles()
+            self.paint_rows()
+
+            # the rows only hold the cached tile looks, the overlays are painted on top
+            dirty = {(self.world_map.selected_tile.x, self.world_map.selected_tile.y)}
+            dirty.update(self.world_map.movement_range)
+            dirty = {p for p in dirty if self.in_window(*p)}
+        else:
+            dirty = {p for p in dirty if self.in_window(*p)}
+            for x, y in dirty:
+                self.render_tile(self.world_map.world[y][x])
+
+        for x, y in dirty:
+            self.paint_tile(self.world_map.world[y][x])
+
+    def visible_window(self):
+        # the tiles that end up on screen: the frame is centred, so a map wider than the screen hangs over both
+        # sides, and the canvas only keeps the rows it has scrolled to
+        canvas = self._frame.canvas
+        dx, dy = canvas.origin
+        width = self.world_map.generation_dict['width']
+        height = self.world_map.generation_dict['height']
+
+        x0 = min(max((-dx - self._x * 2) // 2, 0), width)
+        x1 = max(min(-(-(self._frame.screen.width - dx - self._x * 2) // 2), width), x0)
+        y0 = min(max(canvas.start_line - self._y, 0), height)
+        y1 = max(min(canvas.start_line + canvas.height - self._y, height), y0)
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    def in_window(self, x: int, y: int):
+        x0, y0, width, height = self.window
+        return x0 <= x < x0 + width and y0 <= y < y0 + height
+
+    def render_tiles(self):
+        # the look of every tile without the selection and movement overlays, two cells per tile
+        colors = self.world_map.window_layer('color', self.window).astype(int)
+
+        self.glyphs = full((colors.shape[0], colors.shape[1] * 2), '█', dtype='U1')
+        self.foregrounds = colors.repeat(2, axis=1)
+        self.backgrounds = colors.repeat(2, axis=1)
+
+        if self.show_icons:
+            self.glyphs[:, 0::2] = self.world_map.window_layer('icon', self.window)
+            self.foregrounds[:, 0::2] = 0
+
+        if self.show_heights:
+            # a two digit value only shows its first digit, as the second one always ended up under the next tile
+            self.glyphs[:, 1::2] = self.world_map.window_layer('precipitation', self.window).astype(str).astype('U1')
+            self.foregrounds[:, 1::2] = 0
+
+        for j in self.world_map.entity_tiles(self.window):
+            self.render_tile(j)
+
+    def render_tile(self, j):
+        icon1 = icon2 = '█'
+        icon1_color = icon2_color = j.color
+        icon1_bg = icon2_bg = j.color
+
+        if len(j.entities) > 0:
+            structures = []
+            units = []
+
+            for e in j.entities:
+                if isinstance(e, entities.Structure):
+                    structures.append(e)
+                elif isinstance(e, entities.Unit):
+                    units.append(e)
+
+            if len(structures) > 0 and len(units) == 0:
+                icon2 = structures[-1].data['icon']
+                icon2_color = 0
+                icon2_bg = structures[-1].owner.color
+
+                icon1 = ' '
+                icon1_bg = icon2_bg
+            elif len(units) > 0 and len(structures) == 0:
+                icon1 = units[-1].data['icon']
+                icon1_color = 0
+                icon1_bg = units[-1].owner.color
+
+                icon2 = ' '
+                icon2_bg = icon1_bg
+            else:
+                icon1 = units[-1].data['icon']
+                icon1_color = 0
+                icon1_bg = units[-1].owner.color
+
+                icon2 = structures[-1].data['icon']
+                icon2_color = 0
+                icon2_bg = structures[-1].owner.color
+        elif self.show_icons:
+            icon1 = j.icon
+            icon1_color = 0
+
+        if self.show_heights:
+            icon2 = str(j.precipitation)[0]
+            icon2_color = 0
+
+        x = (j.x - self.window[0]) * 2
+        y = j.y - self.window[1]
+        self.glyphs[y, x:x + 2] = (icon1, icon2)
+        self.foregrounds[y, x:x + 2] = (icon1_color, icon2_color)
+        self.backgrounds[y, x:x + 2] = (icon1_bg, icon2_bg)
+
+    def paint_rows(self):
+        for y in range(0, len(self.glyphs)):
+            foregrounds = self.foregrounds[y].tolist()
+            backgrounds = self.backgrounds[y].tolist()
+
+            # a cell coloured like the one before it continues the same print run
+            colour_map = [(foregrounds[n], Screen.A_NORMAL, backgrounds[n])
+                          if n == 0 or foregrounds[n] != foregrounds[n - 1] or backgrounds[n] != backgrounds[n - 1]
+                          else None
+                          for n in range(0, len(foregrounds))]
+
+            self._frame.canvas.paint(''.join(self.glyphs[y].tolist()), (self._x + self.window[0]) * 2,
+                                     self._y + self.window[1] + y, colour_map=colour_map)
+
+    def paint_tile(self, j):
+        x = (j.x - self.window[0]) * 2
+        y = j.y - self.window[1]
+        icon1, icon2 = self.glyphs[y, x:x + 2].tolist()
+        icon1_color, icon2_color = self.foregrounds[y, x:x + 2].tolist()
+        icon1_bg, icon2_bg = self.backgrounds[y, x:x + 2].tolist()
+
+        if j == self.world_map.selected_tile:
+            if self._has_focus:
+                sel_color = 201
+            else:
+                sel_color = 219
 
-        for i in self.world_map.world:
-            for j in i:
-                icon1 = icon2 = '█'
-                icon1_color = icon2_color = j.color
-                icon1_attr = icon2_attr = Screen.A_NORMAL
-                icon1_bg = icon2_bg = j.color
-
-                if len(j.entities) > 0:
-                    structures = []
-                    units = []
-
-                    for e in j.entities:
-                        if isinstance(e, entities.Structure):
-                            structures.append(e)
-                        elif isinstance(e, entities.Unit):
-                            units.append(e)
-
-                    if len(structures) > 0 and len(units) == 0:
-                        icon2 = structures[-1].data['icon']
-                        icon2_color = 0
-                        icon2_bg = structures[-1].owner.color
-
-                        icon1 = ' '
-                        icon1_bg = icon2_bg
-                    elif len(units) > 0 and len(structures) == 0:
-                        icon1 = units[-1].data['icon']
-                        icon1_color = 0
-                        icon1_bg = units[-1].owner.color
-
-                        icon2 = ' '
-                        icon2_bg = icon1_bg
-                    else:
-                        icon1 = units[-1].data['icon']
-                        icon1_color = 0
-                        icon1_bg = units[-1].owner.color
-
-                        icon2 = structures[-1].data['icon']
-                        icon2_color = 0
-                        icon2_bg = structures[-1].owner.color
-                elif self.show_icons:
-                    icon1 = j.icon
-                    icon1_color = 0
-
-                if self.show_heights:
-                    icon2 = j.precipitation
-                    icon2_color = 0
-
-                if j is self.world_map.selected_tile:
-                    if self._has_focus:
-                        sel_color = 201
-                    else:
-                        sel_color = 219
-
-                    if icon1 == '█':
-                        icon1_color = sel_color
-                    else:
-                        icon1_bg = sel_color
-
-                    if icon2 == '█':
-                        icon2_color = sel_color
-                    else:
-                        icon2_bg = sel_color
+            if icon1 == '█':
+                icon1_color = sel_color
+            else:
+                icon1_bg = sel_color
 
-                self._frame.canvas.paint(f'{icon1}{icon2}', (self._x + j.x) * 2, self._y + j.y,
-                                         colour_map=[(icon1_color, icon1_attr, icon1_bg),
-                                                     (icon2_color, icon2_attr, icon2_bg)])
+            if icon2 == '█':
+                icon2_color = sel_color
+            else:
+                icon2_bg = sel_color
 
-                if self.world_map.is_anchored and isinstance(self.world_map.selected_entity, entities.Unit):
-                    move_distance = self.world_map.selected_entity.data['move_distance']
-                    move_terrain = self.world_map.selected_entity.data['terrain']
+        self._frame.canvas.paint(f'{icon1}{icon2}', (self._x + j.x) * 2, self._y + j.y,
+                                 colour_map=[(icon1_color, Screen.A_NORMAL, icon1_bg),
+                                             (icon2_color, Screen.A_NORMAL, icon2_bg)])
 
-                    if move_distance > 0 and vm.distance((j.x, j.y),
-                                                             (self.world_map.anchor.x, self.world_map.anchor.y)) \
-                            <= move_distance and move_terrain is j.type:
-                        self._frame.canvas.highlight(j.x * 2, j.y, 2, 1, fg=226, bg=icon1_bg, blend=70)
+        if (j.x, j.y) in self.world_map.movement_range:
+            self._frame.canvas.highlight(j.x * 2, j.y, 2, 1, fg=226, bg=icon1_bg, blend=70)
 
     def handle_arrow_input(self, event):
         key_code = event.key_code
@@ -393,7 +499,6 @@ class VoromapView(widgets.Widget):
             self.entity_display.reset()
 
             self.entity_display.location = self.world_map.selected_tile
-            self.entity_display._entity_list = self.world_map.selected_tile.entities
 
             self.entity_display.update(0)
 
@@ -403,14 +508,9 @@ class VoromapView(widgets.Widget):
 
     def move_cursor(self, dx, dy, anchored):
         s = self.world_map.selected_tile
-        d = self.world_map.tile_at_point(s.x + dx, s.y + dy)
 
-        if anchored:
-            a = self.world_map.anchor
-            if self.world_map.distance((a.x, a.y), (s.x + dx, s.y + dy)) > \
-                    self.world_map.selected_entity.data['move_distance'] \
-                    or not self.world_map.selected_entity.data['terrain'] is d.type:
-                return False
+        if anchored and (s.x + dx, s.y + dy) not in self.world_map.movement_range:
+            return False
 
         try:
             self.world_map.selected_tile = self.world_map.tile_at_point(s.x + dx, s.y + dy)
@@ -441,7 +541,7 @@ class VoromapView(widgets.Widget):
                 return event
             elif event.key_code == Screen.KEY_ESCAPE:
                 if self.world_map.is_anchored:
-                    self.world_map.is_anchored = False
+                    self.world_map.cancel_movement()
                     self.update(0)
                     return None
             else:
@@ -461,7 +561,10 @@ class TextInputView(widgets.Text):
                 'icon', 'i', 'Icon', 'I',
                 'genvars', 'gv', 'GenVars', 'GV',
                 'edit', 'e', 'Edit', 'E',
-                'end', 'n', 'End', 'N']
+                'end', 'n', 'End', 'N',
+                'stats', 's', 'Stats', 'S',
+                'save', 'sv', 'Save', 'SV',
+                'load', 'ld', 'Load', 'LD']
     raw_command = ''
 
     def __init__(self, game_model, map_display, console):
@@ -495,15 +598,21 @@ class TextInputView(widgets.Text):
                         self.console.add_line('Invalid filter type.')
 
                 elif main_command in ('regen', 'rg', 'Regen', 'RG'):
-                    self._model.create_new_game(True)
+                    world_seed = None
+                    if len(command_array) > 0 and self.test_valid_int(command_array[0]):
+                        world_seed = int(command_array[0])
+
+                    self._model.create_new_game(True, world_seed)
                     # self.console.height = Screen.height - self._model.world_map.generation_dict['height'] - 1
-                    self.console.add_line('World regenerated.')
+                    self.console.add_line(f'World regenerated (seed {self._model.world_map.seed}).')
                 elif main_command in ('height', 'h', 'Height', 'H'):
                     self.map_display.show_heights = not self.map_display.show_heights
+                    self._model.world_map.mark_all_dirty()
                     self.console.add_line(f'Showing heights: {self.map_display.show_heights}')
                     self.map_display.update(0)
                 elif main_command in ('icon', 'i', 'Icon', 'I'):
                     self.map_display.show_icons = not self.map_display.show_icons
+                    self._model.world_map.mark_all_dirty()
                     self.console.add_line(f'Showing icons: {self.map_display.show_icons}')
                     self.map_display.update(0)
                 elif main_command in ('genvars', 'gv', 'GenVars', 'GV'):
@@ -512,17 +621,79 @@ class TextInputView(widgets.Text):
                 elif main_command in ('edit', 'e', 'Edit', 'E'):
                     if command_array[0] in self.map_display.world_map.generation_dict.keys() and len(command_array) > 1 \
                             and self.test_valid_int(command_array[1]):
-                        self.map_display.world_map.generation_dict[command_array[0]] = int(command_array[1])
+                        world_map = self.map_display.world_map
+                        first_stage = world_map.update_generation({command_array[0]: int(command_array[1])})
                         self.console.add_line(f'{command_array[0]} set to {command_array[1]}')
+
+                        if first_stage in world_map.structural_stages:
+                            # the old tiles are gone, so the factions need new landing sites
+                            self._model.create_new_game(False)
+                            self.console.add_line(f'World rebuilt from the {first_stage} stage.')
+                        elif first_stage is not None:
+                            self.console.add_line(f'Replayed generation from the {first_stage} stage.')
                     else:
                         self.console.add_line('Input a valid generation variable and integer value.')
                 elif main_command in ('end', 'n', 'End', 'N'):
                     self._model.end_turn()
                     self._model.start_turn()
                     self.console.add_line(f'Turn {self._model.turn}')
+                elif main_command in ('stats', 's', 'Stats', 'S'):
+                    self.handle_stats(command_array[0] if len(command_array) > 0 else '')
+                elif main_command in ('save', 'sv', 'Save', 'SV'):
+                    name = command_array[0] if len(command_array) > 0 and command_array[0] != '' else 'quicksave'
+                    try:
+                        os.makedirs(savegame.save_dir, exist_ok=True)
+                        savegame.save_game(self._model, savegame.save_path(name))
+                        self.console.add_line(f'Game saved as {name}.')
+                    except OSError as ex:
+                        self.console.add_line(f'Could not save: {ex.strerror}')
+                    except ValueError as ex:
+                        self.console.add_line(f'Could not save: {ex}')
+                elif main_command in ('load', 'ld', 'Load', 'LD'):
+                    if len(command_array) == 0 or command_array[0] == '':
+                        for name in savegame.save_names():
+                            try:
+                                description = savegame.describe_save(savegame.save_path(name))
+                            except savegame.load_errors:
+                                description = 'unreadable'
+                            self.console.add_line(f'{name}: {description}')
+                        self.console.add_line('Load one with: load <name>')
+                    elif command_array[0] not in savegame.save_names():
+                        self.console.add_line(f'No save named {command_array[0]}.')
+                    else:
+                        try:
+                            savegame.load_game(self._model, savegame.save_path(command_array[0]))
+                            world_map = self._model.world_map
+                            self.map_display.entity_display.location = world_map.selected_tile
+                            self.console.add_line(f'Loaded {command_array[0]} (turn {self._model.turn}).')
+                        except savegame.load_errors as ex:
+                            self.console.add_line(f'Could not load: {ex}')
             else:
                 self.console.add_line('Invalid command.')
 
+    def handle_stats(self, option):
+        if option in ('on', 'On'):
+            profiling.enable()
+            self.console.add_line('Profiling on.')
+        elif option in ('mem', 'Mem'):
+            # tracemalloc slows everything down noticeably, so allocations are only tracked on request
+            profiling.enable(allocations=True)
+            self.console.add_line('Profiling on, tracking allocations.')
+        elif option in ('off', 'Off'):
+            profiling.disable()
+            self.console.add_line('Profiling off.')
+        elif option in ('reset', 'Reset'):
+            profiling.reset()
+            self.console.add_line('Profiling stats cleared.')
+        else:
+            lines = profiling.report_lines()
+            for line in lines:
+                self.console.add_line(line)
+            if len(lines) == 0 and profiling.enabled:
+                self.console.add_line('No profiling stats recorded.')
+            elif len(lines) == 0:
+                self.console.add_line("Profiling is off, 'stats on' turns it on.")
+
     def test_valid_int(self, s):
         try:
             int(s)
@@ -567,7 +738,7 @@ class GameView(widgets.Frame):
         layout = widgets.Layout([int(self._model.world_map.generation_dict['width'] * 2), 30])
 
         self._info_bar = InfoBar(self._model)
-        self._entity_display = EntityView([], self._model.world_map.selected_tile, self._model)
+        self._entity_display = EntityView(self._model.world_map.selected_tile, self._model)
         self._map_console = ConsoleView(screen.height - self._model.world_map.generation_dict['height'] - 2)
         self._map_view = VoromapView(self._model.world_map, self._map_console, self._entity_display)
         self._map_view.l = layout
@@ -583,6 +754,16 @@ class GameView(widgets.Frame):
 
         self.fix()
 
+    def _clear(self):
+        # clears everything but the map, which keeps its cells from the last frame and repaints only changed tiles
+        (colour, attr, bg) = self.palette['background']
+        map_width = self._model.world_map.generation_dict['width'] * 2
+        map_height = self._model.world_map.generation_dict['height']
+
+        self._canvas.clear_buffer(colour, attr, bg, map_width, 0, self._canvas.width - map_width, map_height)
+        self._canvas.clear_buffer(colour, attr, bg, 0, map_height, self._canvas.width,
+                                  self._canvas.height - map_height)
+
     def _reload_map(self):
         self._map_view.world = self._model.world_map
 
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from numpy import bincount
+import voromap
+import worldstore
+from worldgrid import tile_types
+
+
+# usage:
+#   python batchgen.py --first-seed 0 --count 500 --out worlds/
+#   python batchgen.py --settings big.json --set continent_count=6 --set percent_land=40 --count 64 --out worlds/
+#
+# every world is written as worlds/world_<seed>.npz in the same format as the world cache, next to a summary.json
+# with the settings used and per world metrics
+
+
+def parse_value(text: str):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def world_metrics(world_map: voromap.WorldMap):
+    land = world_map.get_layer('type') == tile_types.index('Land')
+
+    continent_ids = world_map.continent_ids
+    sizes = bincount(continent_ids[continent_ids >= 0], minlength=len(world_map.continents))
+
+    return {'seed': world_map.seed,
+            'land_percent': round(float(land.mean()) * 100, 2),
+            'region_count': len(world_map.regions),
+            'continent_count': len(world_map.continents),
+            'continent_sizes': sizes.tolist(),
+            'continent_regions': [len(c.regions) for c in world_map.continents]}
+
+
+def generate_world(settings: dict, seed: int, out_dir: str):
+    # runs in a worker process, so changing the class level settings only affects this process
+    voromap.WorldMap.cache_dir = None
+    voromap.WorldMap.generation_dict.update(settings)
+    g = voromap.WorldMap.generation_dict
+
+    start = time.perf_counter()
+    world_map = voromap.WorldMap(g['width'], g['height'], g['min_altitude'], g['sea_level'], g['max_altitude'],
+                                 g['seed_count'], seed=seed)
+    elapsed = time.perf_counter() - start
+
+    path = os.path.join(out_dir, f'world_{seed}.npz')
+    worldstore.save_world(world_map, path)
+
+    metrics = world_metrics(world_map)
+    metrics['file'] = os.path.basename(path)
+    metrics['seconds'] = round(elapsed, 3)
+
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a library of worlds over a range of seeds.')
+    parser.add_argument('--out', required=True, help='directory the world bundles and summary.json are written to')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--count', type=int, default=16, help='number of consecutive seeds to generate')
+    parser.add_argument('--settings', help='JSON file of generation_dict values')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a single generation_dict value, may be repeated')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.settings:
+        with open(args.settings) as f:
+            settings.update(json.load(f))
+    for item in args.set:
+        key, _, value = item.partition('=')
+        settings[key] = parse_value(value)
+
+    unknown = [k for k in settings if k not in voromap.WorldMap.generation_dict]
+    if len(unknown) > 0:
+        parser.error(f'unknown generation settings: {", ".join(unknown)}')
+
+    os.makedirs(args.out, exist_ok=True)
+    seeds = range(args.first_seed, args.first_seed + args.count)
+
+    start = time.perf_counter()
+    worlds = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(generate_world, settings, seed, args.out) for seed in seeds]
+        for future in as_completed(futures):
+            metrics = future.result()
+            worlds.append(metrics)
+            print(f'[{len(worlds)}/{len(futures)}] seed {metrics["seed"]}: {metrics["land_percent"]}% land, '
+                  f'{metrics["continent_count"]} continents, {metrics["seconds"]:.2f}s', file=sys.stderr)
+
+    worlds.sort(key=lambda m: m['seed'])
+
+    generation = dict(voromap.WorldMap.generation_dict)
+    generation.update(settings)
+    summary = {'generation': generation, 'first_seed': args.first_seed, 'count': args.count,
+               'seconds': round(time.perf_counter() - start, 3), 'worlds': worlds}
+
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
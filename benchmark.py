@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from statistics import median
+import numpy
+import voromap
+from noisefield import noise_field
+
+
+# usage:
+#   python benchmark.py --sizes 80x40 400x200 --seed-counts 100 1000 --repeat 3 --out bench.json
+#   python benchmark.py --out new.json --compare old.json
+#   python benchmark.py --sizes 4000x2000 --seed-counts 3000 --workers 8 --out parallel.json --compare serial.json
+
+default_sizes = ['80x40', '200x100', '400x200', '1000x500']
+default_seed_counts = [100, 1000]
+
+# WorldMap methods timed on every run, in pipeline order
+timed_methods = ['set_seeds', 'voronoi_stage', 'set_world_regions', 'generate_continents', 'assign_tiles_to_regions',
+                 'update_region_tiles', 'gen_mountain_ranges', 'apply_simplex_noise', 'gaussian_smooth',
+                 'set_sea_tiles', 'truncate_tile_heights', 'set_heat_map', 'set_precipitation_map', 'terrain_filter']
+
+
+def timed(method, samples: list):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        samples[-1] += time.perf_counter() - start
+        return result
+
+    return wrapper
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(samples: [float]):
+    return {'min': min(samples), 'median': median(samples), 'mean': sum(samples) / len(samples)}
+
+
+def run_case(width: int, height: int, seed_count: int, repeat: int, first_seed: int, workers: int = 1):
+    # one untimed world to build the instance, then `repeat` timed regenerations on fresh seeds.
+    # nothing may come from a cache: the world cache is switched off and the noise cache emptied per run
+    voromap.WorldMap.cache_dir = None
+    voromap.WorldMap.tile_workers = workers
+
+    world_map = voromap.WorldMap(width, height, 0, 3, 9, seed_count, seed=first_seed)
+
+    samples = {name: [] for name in timed_methods}
+    for name in timed_methods:
+        setattr(world_map, name, timed(getattr(world_map, name), samples[name]))
+
+    totals = []
+    for i in range(0, repeat):
+        for name in timed_methods:
+            samples[name].append(0.0)
+
+        noise_field.cache_clear()
+
+        start = time.perf_counter()
+        world_map.regenerate(first_seed + i + 1)
+        totals.append(time.perf_counter() - start)
+
+    return {'width': width, 'height': height, 'seed_count': seed_count, 'repeat': repeat,
+            'regions': len(world_map.regions), 'continents': len(world_map.continents),
+            'total': summarize(totals),
+            'stages': {name: summarize(samples[name]) for name in timed_methods}}
+
+
+def compare(new: dict, old: dict):
+    old_cases = {(c['width'], c['height'], c['seed_count']): c for c in old['results']}
+
+    for case in new['results']:
+        key = (case['width'], case['height'], case['seed_count'])
+        if key not in old_cases:
+            continue
+
+        before = old_cases[key]
+        print(f'{case["width"]}x{case["height"]}, {case["seed_count"]} seeds '
+              f'({old.get("commit")} -> {new.get("commit")})')
+
+        rows = [('total', before['total'], case['total'])]
+        rows += [(name, before['stages'].get(name), stats) for name, stats in case['stages'].items()]
+        for name, a, b in rows:
+            if a is None or a['median'] <= 0:
+                continue
+            print(f'  {name:<24} {a["median"] * 1000:10.2f} ms {b["median"] * 1000:10.2f} ms '
+                  f'{b["median"] / a["median"]:7.2f}x')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each WorldMap generation stage across map sizes.')
+    parser.add_argument('--sizes', nargs='+', default=default_sizes, help='map sizes as WIDTHxHEIGHT')
+    parser.add_argument('--seed-counts', nargs='+', type=int, default=default_seed_counts)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0, help='first world seed, runs use the following ones')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for the per tile stages')
+    parser.add_argument('--out', help='write results as JSON here instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        width, height = (int(i) for i in size.lower().split('x'))
+        for seed_count in args.seed_counts:
+            case = run_case(width, height, seed_count, args.repeat, args.seed, args.workers)
+            results.append(case)
+            print(f'{width}x{height}, {seed_count} seeds: {case["total"]["median"] * 1000:.1f} ms median',
+                  file=sys.stderr)
+
+    report = {'commit': current_commit(), 'python': platform.python_version(), 'numpy': numpy.__version__,
+              'machine': platform.machine(), 'cpus': os.cpu_count(), 'workers': args.workers, 'results': results}
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from numpy import zeros
+from numpy.lib.format import open_memmap
+from entityindex import EntityIndex
+from worldgrid import WorldGrid
+from worldgrid import layer_formats
+
+
+# a world split into chunk_size x chunk_size chunks that are only generated when a tile in them is first read.
+# region and continent structure stays global on the WorldMap; everything per tile (region labels, ridges, noise,
+# smoothing, sea, climate and colours) is produced per chunk by the same WorldMap helpers the whole map stages use,
+# so a chunk holds exactly the values a fully generated map would
+
+# per chunk arrays: the tile layers plus the region and continent id grids
+chunk_formats = dict(layer_formats, region_ids=('i4', -1), continent_ids=('i4', -1))
+
+
+class ChunkLayer:
+    # stands in for a whole map array, indexed [y, x] like the WorldGrid layers
+    __slots__ = ('world', 'name')
+
+    def __init__(self, world, name: str):
+        self.world = world
+        self.name = name
+
+    def __getitem__(self, index: (int, int)):
+        y, x = index
+        chunk, y, x = self.world.chunk_at(x, y, self.name != 'region_ids')
+        return chunk[self.name][y, x]
+
+    def __setitem__(self, index: (int, int), value):
+        y, x = index
+        chunk, y, x = self.world.chunk_at(x, y, True, modify=True)
+        chunk[self.name][y, x] = value
+
+
+class ChunkedWorld(WorldGrid):
+    def __init__(self, world_map, width: int, height: int, chunk_size: int, cache_size: int, spill_dir: str = None):
+        self.world_map = world_map
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.columns = -(-width // chunk_size)
+        self.rows = -(-height // chunk_size)
+
+        self.layers = {name: ChunkLayer(self, name) for name in chunk_formats}
+        self.entity_index = EntityIndex()
+
+        # (cx, cy): {name: array}, least recently used first. a chunk that only holds 'region_ids' has been
+        # labelled but not generated yet
+        self.chunks = OrderedDict()
+        # chunks edited after generation; without a spill file they are never evicted
+        self.modified = set()
+        # applied on top of the terrain colours of every generated chunk, None for plain terrain colours
+        self.color_filter = None
+
+        self.spill_dir = spill_dir
+        self.spill = None
+        self.spilled = zeros((self.rows, self.columns), dtype=bool)
+
+    def chunk_bounds(self, cx: int, cy: int):
+        x0 = cx * self.chunk_size
+        y0 = cy * self.chunk_size
+        return x0, y0, min(x0 + self.chunk_size, self.width), min(y0 + self.chunk_size, self.height)
+
+    def chunk_at(self, x: int, y: int, generated: bool = True, modify: bool = False):
+        # the chunk holding tile (x, y), plus the tile's position inside it
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError('tile index out of range')
+
+        key = (x // self.chunk_size, y // self.chunk_size)
+        chunk = self.get_chunk(key, generated or modify)
+        if modify:
+            self.modified.add(key)
+
+        return chunk, y - key[1] * self.chunk_size, x - key[0] * self.chunk_size
+
+    def get_chunk(self, key: (int, int), generated: bool = True):
+        chunk = self.chunks.get(key)
+
+        if chunk is None:
+            if self.spilled[key[1], key[0]]:
+                chunk = self.load_spilled(key)
+            else:
+                x0, y0, x1, y1 = self.chunk_bounds(*key)
+                chunk = {'region_ids': self.world_map.label_tiles((x0, y0, x1 - x0, y1 - y0))}
+
+            self.chunks[key] = chunk
+            self.evict(key)
+        else:
+            self.chunks.move_to_end(key)
+
+        if generated and 'height' not in chunk:
+            self.generate_chunk(key, chunk)
+
+        return chunk
+
+    def generate_chunk(self, key: (int, int), chunk: dict):
+        world_map = self.world_map
+        x0, y0, x1, y1 = self.chunk_bounds(*key)
+
+        # everything up to smoothing runs over the chunk plus a halo as wide as the smoothing kernel, so the filter
+        # sees the same neighbours at chunk edges as it does over the whole map
+        halo = world_map.smoothing_halo()
+        hx0 = max(x0 - halo, 0)
+        hy0 = max(y0 - halo, 0)
+        window = (hx0, hy0, min(x1 + halo, self.width) - hx0, min(y1 + halo, self.height) - hy0)
+
+        grid = WorldGrid(window[2], window[3], world_map.generation_dict['min_altitude'])
+        world_map.fill_region_layers(grid.layers, world_map.label_tiles(window))
+
+        heights = grid.layers['height']
+        for range_lines in world_map.ridge_lines:
+            heights[...] = world_map.ridge_heights(heights, window, range_lines)
+        heights[...] = world_map.noise_heights(heights, window)
+        heights[...] = world_map.smooth_heights(heights)
+
+        inner = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+        for name, values in grid.layers.items():
+            chunk[name] = values[inner].copy()
+
+        types, heights = world_map.sea_layers(chunk['type'], chunk['height'])
+        chunk['type'][...] = types
+        chunk['height'][...] = world_map.truncated_heights(heights)
+
+        window = (x0, y0, x1 - x0, y1 - y0)
+        chunk['temperature'][...] = world_map.heat_values(window)
+        chunk['precipitation'][...] = world_map.precipitation_values(chunk['temperature'], window)
+
+        chunk['continent_ids'] = world_map.continent_lookup()[chunk['region_ids']]
+
+        chunk['color'][...] = world_map.terrain_colors(chunk.__getitem__)
+        if self.color_filter is not None:
+            chunk['color'][...] = self.color_filter(chunk.__getitem__)
+
+    def evict(self, keep: (int, int)):
+        # keep is the chunk being handed out, which may be about to be edited
+        if len(self.chunks) <= self.cache_size:
+            return
+
+        for key in list(self.chunks):
+            if len(self.chunks) <= self.cache_size:
+                return
+            if key == keep:
+                continue
+
+            chunk = self.chunks[key]
+            if self.spill_dir is not None and 'height' in chunk:
+                self.spill_chunk(key, chunk)
+            elif key in self.modified:
+                continue
+
+            del self.chunks[key]
+            self.modified.discard(key)
+
+    def spill_chunk(self, key: (int, int), chunk: dict):
+        if self.spill is None:
+            # one sparse .npy per array over the whole map; only the pages of spilled chunks are ever written
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = tempfile.mkdtemp(prefix='chunks-', dir=self.spill_dir)
+            weakref.finalize(self, shutil.rmtree, path, True)
+
+            self.spill = {name: open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=dtype,
+                                            shape=(self.height, self.width))
+                          for name, (dtype, default) in chunk_formats.items()}
+
+        x0, y0, x1, y1 = self.chunk_bounds(*key)
+        for name, values in self.spill.items():
+            values[y0:y1, x0:x1] = chunk[name]
+        self.spilled[key[1], key[0]] = True
+
+    def load_spilled(self, key: (int, int)):
+        x0, y0, x1, y1 = self.chunk_bounds(*key)
+        chunk = {name: values[y0:y1, x0:x1].copy() for name, values in self.spill.items()}
+
+        # the colour filter may have changed while the chunk was out
+        chunk['color'][...] = self.world_map.terrain_colors(chunk.__getitem__)
+        if self.color_filter is not None:
+            chunk['color'][...] = self.color_filter(chunk.__getitem__)
+
+        return chunk
+
+    def set_color_filter(self, colors_of):
+        self.color_filter = colors_of
+
+        for chunk in self.chunks.values():
+            if 'height' in chunk:
+                chunk['color'][...] = self.world_map.terrain_colors(chunk.__getitem__)
+                if colors_of is not None:
+                    chunk['color'][...] = colors_of(chunk.__getitem__)
+
+    def clear(self):
+        # drop every chunk, e.g. after the generation settings changed
+        self.chunks.clear()
+        self.modified.clear()
+        self.spilled[...] = False
+
+    def full_layer(self, name: str):
+        # the whole map at once; generates every chunk, so only meant for maps that would fit in memory anyway
+        return self.window_layer(name, 0, 0, self.width, self.height)
+
+    def window_layer(self, name: str, x0: int, y0: int, x1: int, y1: int):
+        # the layer values of tiles x0 <= x < x1, y0 <= y < y1, generating the chunks they are in
+        dtype, default = chunk_formats[name]
+        values = zeros((y1 - y0, x1 - x0), dtype=dtype)
+
+        for cy in range(y0 // self.chunk_size, -(-y1 // self.chunk_size)):
+            for cx in range(x0 // self.chunk_size, -(-x1 // self.chunk_size)):
+                bx0, by0, bx1, by1 = self.chunk_bounds(cx, cy)
+                ix0, iy0, ix1, iy1 = max(bx0, x0), max(by0, y0), min(bx1, x1), min(by1, y1)
+                values[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = \
+                    self.get_chunk((cx, cy))[name][iy0 - by0:iy1 - by0, ix0 - bx0:ix1 - bx0]
+
+        return values
+
+    def write_layer(self, name: str, values):
+        for cy in range(0, self.rows):
+            for cx in range(0, self.columns):
+                x0, y0, x1, y1 = self.chunk_bounds(cx, cy)
+                self.get_chunk((cx, cy))[name][...] = values[y0:y1, x0:x1]
+                self.modified.add((cx, cy))
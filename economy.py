@@ -0,0 +1,53 @@
+from numpy import zeros
+
+
+# per faction economy columns with one row per entity. a faction's turn adds up a few columns instead of calling
+# every entity; entities say what goes in their row through Entity.economy()
+
+columns = ['produces_minerals', 'produces_currency', 'upkeep', 'pop_cap', 'energy_cost']
+
+
+class Ledger:
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.columns = {name: zeros(capacity, dtype='i8') for name in columns}
+
+        # row of every entity, and the entity in every row
+        self.rows = {}
+        self.entities = []
+
+    def __len__(self):
+        return self.size
+
+    def add(self, entity, values: dict):
+        if self.size == len(self.columns[columns[0]]):
+            for name, values_of in self.columns.items():
+                grown = zeros(len(values_of) * 2, dtype=values_of.dtype)
+                grown[:self.size] = values_of[:self.size]
+                self.columns[name] = grown
+
+        row = self.size
+        for name in columns:
+            self.columns[name][row] = values.get(name, 0)
+
+        self.rows[entity] = row
+        self.entities.append(entity)
+        self.size += 1
+
+    def remove(self, entity):
+        # the last row moves into the freed one
+        row = self.rows.pop(entity)
+        last = self.size - 1
+
+        if row != last:
+            moved = self.entities[last]
+            for values_of in self.columns.values():
+                values_of[row] = values_of[last]
+            self.entities[row] = moved
+            self.rows[moved] = row
+
+        self.entities.pop()
+        self.size -= 1
+
+    def total(self, name: str):
+        return int(self.columns[name][:self.size].sum())
@@ -1,3 +1,4 @@
+from types import MappingProxyType
 import game
 
 # *Necessary*
@@ -20,40 +21,70 @@ import game
 # strength: combat stat, power multiplier
 # armor: combat stat, casualty divisor
 
-mine_structure = {'name': 'Mine', 'icon': 'Ѫ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
-                  'produces_minerals': 10}
-solar_structure = {'name': 'Solar Array', 'icon': 'Ξ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
-                   'energy_cost': -2}
-city_structure = {'name': 'City Center', 'icon': 'ʘ', 'type': 'structure', 'cost': 200, 'upkeep': 50,
-                  'energy_cost': -1, 'produces_currency': 1000, 'pop_cap': 25000}
-population_structure = {'name': 'Habitat', 'icon': 'Ҧ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
-                        'energy_cost': 1, 'pop_cap': 10000}
+# templates are read only and shared: every entity made from one refers to the same mapping, and equal templates are
+# the same object. the defaults for their type are filled in once, when the template is made
 
-constructor = {'name': 'Constructor', 'icon': 'Ɣ', 'type': 'unit', 'cost': 50, 'upkeep': 25,
-               'move_distance': 2, 'terrain': 'Land',
-               'size': 5, 'strength': 2, 'armor': 10,
-               'constructs': [mine_structure, solar_structure, population_structure]}
+type_defaults = {'entity': {'name': '', 'icon': '/', 'type': 'entity', 'cost': 0, 'upkeep': 0},
+                 'structure': {'energy_cost': 0},
+                 'unit': {'size': 1, 'strength': 1, 'armor': 1, 'move_distance': 1, 'terrain': 'Land'}}
 
+interned_templates = {}
 
-class Entity:
 
-    data = {'name': '', 'icon': '/', 'type': 'entity', 'cost': 0, 'upkeep': 0}
+def template(data):
+    if isinstance(data, MappingProxyType):
+        return data
+
+    values = dict(type_defaults['entity'])
+    values.update(type_defaults.get(data.get('type'), {}))
+    values.update(data)
+    if 'constructs' in values:
+        values['constructs'] = tuple(template(c) for c in values['constructs'])
+
+    # nested templates are interned already, so they can be told apart by identity
+    key = tuple(sorted((k, tuple(map(id, v)) if k == 'constructs' else v) for k, v in values.items()))
+    if key not in interned_templates:
+        interned_templates[key] = MappingProxyType(values)
+
+    return interned_templates[key]
+
+
+mine_structure = template({'name': 'Mine', 'icon': 'Ѫ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
+                           'produces_minerals': 10})
+solar_structure = template({'name': 'Solar Array', 'icon': 'Ξ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
+                            'energy_cost': -2})
+city_structure = template({'name': 'City Center', 'icon': 'ʘ', 'type': 'structure', 'cost': 200, 'upkeep': 50,
+                           'energy_cost': -1, 'produces_currency': 1000, 'pop_cap': 25000})
+population_structure = template({'name': 'Habitat', 'icon': 'Ҧ', 'type': 'structure', 'cost': 50, 'upkeep': 50,
+                                 'energy_cost': 1, 'pop_cap': 10000})
+
+constructor = template({'name': 'Constructor', 'icon': 'Ɣ', 'type': 'unit', 'cost': 50, 'upkeep': 25,
+                        'move_distance': 2, 'terrain': 'Land',
+                        'size': 5, 'strength': 2, 'armor': 10,
+                        'constructs': [mine_structure, solar_structure, population_structure]})
+
+# every template by name, so saved games can refer to them
+templates = {t['name']: t for t in [mine_structure, solar_structure, city_structure, population_structure,
+                                     constructor]}
+
+
+class Entity:
+    # per entity state is just these references; everything else is in the shared template
+    __slots__ = ('owner', 'location', 'data')
 
     def __init__(self, owner, location, new_data: dict):
         self.owner = owner
         self.location = location
-        self.data = new_data
-
-        # print(self.data)
+        self.data = template(new_data)
 
     def handle_abilities(self):
         return
 
-    def start_turn(self):
-        return
-
-    def end_turn(self):
-        self.owner.currency -= self.data['upkeep']
+    def economy(self):
+        # this entity's row in its faction's ledger; upkeep is paid at the end of every turn
+        return {'upkeep': self.data['upkeep'],
+                'pop_cap': self.data.get('pop_cap', 0),
+                'energy_cost': self.data.get('energy_cost', 0)}
 
     def display_quick(self):
         return [f"{self.data['icon']} {self.data['name']}"]
@@ -65,27 +96,14 @@ class Entity:
 
 
 class Structure(Entity):
+    __slots__ = ()
 
-    structure_data = {'energy_cost': 0}
-
-    def __init__(self, owner, location, data: dict):
-        for k in self.structure_data.keys():
-            self.data[k] = self.structure_data[k]
-
-        super().__init__(owner, location, data)
-
-        for k in self.structure_data.keys():
-            if not self.data.keys().__contains__(k):
-                self.data[k] = self.structure_data[k]
-
-    def start_turn(self):
-        if self.data.keys().__contains__('produces_minerals'):
-            self.owner.minerals += self.data['produces_minerals']
-
-        if self.data.keys().__contains__('produces_currency'):
-            self.owner.currency += self.data['produces_currency']
-
-        super().start_turn()
+    def economy(self):
+        # structures also produce at the start of every turn
+        row = super().economy()
+        row['produces_minerals'] = self.data.get('produces_minerals', 0)
+        row['produces_currency'] = self.data.get('produces_currency', 0)
+        return row
 
     def display_quick(self):
         quick = super().display_quick()
@@ -111,22 +129,15 @@ class Structure(Entity):
 
 
 class Unit(Entity):
-    used_movement = 0
-
-    unit_data = {'size': 1, 'strength': 1, 'armor': 1, 'move_distance': 1, 'terrain': 'Land'}
+    __slots__ = ('used_movement',)
 
     def __init__(self, owner, location, data: dict):
         super().__init__(owner, location, data)
-
-        for k in self.unit_data.keys():
-            if not self.data.keys().__contains__(k):
-                self.data[k] = self.unit_data[k]
+        self.used_movement = 0
 
     def end_turn(self):
         self.used_movement = 0
 
-        super().end_turn()
-
     def handle_abilities(self, event):
         if self.data.keys().__contains__('constructs'):
             if (49 + len(self.data['constructs'])) >= event.key_code >= 49:
@@ -0,0 +1,103 @@
+from math import floor
+
+
+# entities by tile coordinate. only occupied tiles have an entry, so bookkeeping grows with the number of entities and
+# not with the map. occupied tiles are also grouped into bucket_size squares per faction, so area queries only look
+# at the squares they overlap
+
+bucket_size = 16
+
+# what an empty tile's entity list reads as; a tuple, so nothing can be appended to it by accident
+no_entities = ()
+
+
+class EntityIndex:
+    def __init__(self):
+        # (x, y): [entity] in the order they arrived
+        self.tiles = {}
+        # faction: {(x, y): [entity]}, the same per tile order restricted to one faction
+        self.faction_tiles = {}
+        # (x // bucket_size, y // bucket_size): {(x, y)} occupied tiles in that square
+        self.buckets = {}
+
+    def __len__(self):
+        return sum(len(tile_entities) for tile_entities in self.tiles.values())
+
+    def at(self, x: int, y: int):
+        return self.tiles.get((x, y), no_entities)
+
+    def items(self):
+        return self.tiles.items()
+
+    def positions(self, faction=None):
+        tiles = self.tiles if faction is None else self.faction_tiles.get(faction, {})
+        return sorted(tiles, key=lambda p: (p[1], p[0]))
+
+    def faction_at(self, faction, x: int, y: int):
+        return self.faction_tiles.get(faction, {}).get((x, y), no_entities)
+
+    def add(self, entity, x: int, y: int):
+        position = (x, y)
+
+        if position not in self.tiles:
+            self.tiles[position] = []
+            self.buckets.setdefault((x // bucket_size, y // bucket_size), set()).add(position)
+        self.tiles[position].append(entity)
+
+        self.faction_tiles.setdefault(entity.owner, {}).setdefault(position, []).append(entity)
+
+    def remove(self, entity, x: int, y: int):
+        position = (x, y)
+
+        tile_entities = self.tiles[position]
+        tile_entities.remove(entity)
+        if len(tile_entities) == 0:
+            del self.tiles[position]
+            bucket = self.buckets[(x // bucket_size, y // bucket_size)]
+            bucket.discard(position)
+            if len(bucket) == 0:
+                del self.buckets[(x // bucket_size, y // bucket_size)]
+
+        owned = self.faction_tiles[entity.owner]
+        owned[position].remove(entity)
+        if len(owned[position]) == 0:
+            del owned[position]
+
+    def move(self, entity, origin: (int, int), destination: (int, int)):
+        self.remove(entity, *origin)
+        self.add(entity, *destination)
+
+    def clear(self):
+        self.tiles.clear()
+        self.faction_tiles.clear()
+        self.buckets.clear()
+
+    def positions_in_rect(self, x0: int, y0: int, x1: int, y1: int, faction=None):
+        # occupied tiles with x0 <= x < x1 and y0 <= y < y1, row by row
+        tiles = self.tiles if faction is None else self.faction_tiles.get(faction, {})
+        found = []
+
+        if len(tiles) == 0 or x1 <= x0 or y1 <= y0:
+            return found
+
+        for by in range(y0 // bucket_size, (y1 - 1) // bucket_size + 1):
+            for bx in range(x0 // bucket_size, (x1 - 1) // bucket_size + 1):
+                for x, y in self.buckets.get((bx, by), ()):
+                    if x0 <= x < x1 and y0 <= y < y1 and (x, y) in tiles:
+                        found.append((x, y))
+
+        found.sort(key=lambda p: (p[1], p[0]))
+        return found
+
+    def in_rect(self, x0: int, y0: int, x1: int, y1: int, faction=None):
+        tiles = self.tiles if faction is None else self.faction_tiles.get(faction, {})
+        return [e for p in self.positions_in_rect(x0, y0, x1, y1, faction) for e in tiles[p]]
+
+    def in_radius(self, x: int, y: int, radius: float, faction=None):
+        # entities on tiles at most radius away from (x, y) in a straight line
+        tiles = self.tiles if faction is None else self.faction_tiles.get(faction, {})
+        reach = floor(radius)
+
+        return [e for px, py in self.positions_in_rect(x - reach, y - reach, x + reach + 1, y + reach + 1, faction)
+                if (px - x) ** 2 + (py - y) ** 2 <= radius * radius
+                for e in tiles[(px, py)]]
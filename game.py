@@ -1,9 +1,11 @@
 import voromap
 import entities
-from random import randint
-from random import shuffle
-from random import seed
+import profiling
+from random import Random
 import copy
+import os
+from economy import Ledger
+import aiplanner
 
 
 faction_icons = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
@@ -26,22 +28,33 @@ class Faction:
         self.faction_icon = faction_icon
         self.origin = landing_site
         self.entities = []
+        # units are the only entities with something to do at the end of a turn
+        self.units = []
+        self.ledger = Ledger()
+
+    def add_entity(self, e: entities.Entity):
+        self.entities.append(e)
+        if isinstance(e, entities.Unit):
+            self.units.append(e)
+        self.ledger.add(e, e.economy())
+
+    def energy_balance(self):
+        return -self.ledger.total('energy_cost')
 
     def start_turn(self):
-        self.population_cap = 0
-        for e in self.entities:
-            if e.data.keys().__contains__('pop_cap'):
-                self.population_cap += e.data['pop_cap']
+        self.population_cap = self.ledger.total('pop_cap')
 
         if self.population < self.population_cap:
             self.population = int(self.population * 1.02)
 
-        for e in self.entities:
-            e.start_turn()
+        self.minerals += self.ledger.total('produces_minerals')
+        self.currency += self.ledger.total('produces_currency')
         return
 
     def end_turn(self):
-        for e in self.entities:
+        self.currency -= self.ledger.total('upkeep')
+
+        for e in self.units:
             e.end_turn()
         return
 
@@ -49,6 +62,10 @@ class Faction:
 class Game:
     turn = 0
 
+    # worker processes that plan the turns of the factions nobody plays; None uses one per faction, up to the number of
+    # cpus, and 1 plans them here, one after another
+    ai_workers = None
+
     def __init__(self, world_map: voromap.WorldMap, faction_count):
         self.world_map = world_map
         self.factions = []
@@ -56,34 +73,63 @@ class Game:
 
         self.create_new_game(False)
 
+    @profiling.profiled('game.start_turn')
     def start_turn(self):
         for f in self.factions:
             f.start_turn()
 
+    @profiling.profiled('game.end_turn')
     def end_turn(self):
+        self.play_ai_turns()
+
         for f in self.factions:
             f.end_turn()
 
         self.turn += 1
 
-    def create_new_game(self, regenerate_world: bool):
-        seed(randint(0, 100))
-
+    @profiling.profiled('game.ai_turns')
+    def play_ai_turns(self):
+        ai_factions = [f for f in self.factions if not f.is_player]
+        workers = self.ai_workers
+        if workers is None:
+            workers = min(len(ai_factions), os.cpu_count() or 1)
+        plans = aiplanner.plan_turns(self.world_map, ai_factions, workers)
+
+        # plans are carried out in faction order, whichever finished first
+        for f, actions in zip(ai_factions, plans):
+            stuck = set()
+            for kind, n, value in actions:
+                u = f.units[n]
+                if kind == 'move':
+                    if not self.world_map.move_entity(u, u.location, self.world_map.tile_at_point(*value)):
+                        # the build was planned for the destination, not for where the unit still is
+                        stuck.add(n)
+                elif kind == 'build':
+                    # factions plan at the same time, so an earlier one may have built here this turn
+                    if n in stuck or any(e.data['type'] == 'structure' for e in u.location.entities):
+                        continue
+                    create_owned_entity(f, u.location, entities.templates[value])
+                    self.world_map.mark_dirty(u.location)
+
+    def create_new_game(self, regenerate_world: bool, world_seed: int = None):
         self.factions = []
 
         if regenerate_world:
-            self.world_map.regenerate()
+            self.world_map.regenerate(world_seed)
+
+        # factions are placed from the world seed, so sharing a seed shares the whole starting position
+        rng = Random(self.world_map.seed)
 
         faction_icons_c = copy.copy(faction_icons)
-        shuffle(faction_icons_c)
+        rng.shuffle(faction_icons_c)
         faction_colors_c = copy.copy(faction_colors)
-        shuffle(faction_colors_c)
+        rng.shuffle(faction_colors_c)
 
         for i in range(0, self.faction_count):
-            c = randint(0, len(faction_colors_c) - 1)
-            i = randint(0, len(faction_icons_c) - 1)
+            c = rng.randint(0, len(faction_colors_c) - 1)
+            i = rng.randint(0, len(faction_icons_c) - 1)
 
-            f = Faction(faction_icons_c[i], faction_colors_c[c], self.world_map.get_random_land_tile())
+            f = Faction(faction_icons_c[i], faction_colors_c[c], self.world_map.get_random_land_tile(rng))
 
             self.factions.append(f)
             create_owned_entity(f, f.origin, entities.city_structure)
@@ -99,12 +145,12 @@ class Game:
 
 def create_owned_entity(owner: Faction, tile, data):
     e = entities.create_entity(owner, tile, data)
-    tile.entities.append(e)
-    owner.entities.append(e)
+    tile.entity_index.add(e, tile.x, tile.y)
+    owner.add_entity(e)
 
     return e
 
 
 def place_entity(entity: entities.Entity, tile: voromap.Tile):
-    tile.entities.append(entity)
+    tile.entity_index.add(entity, tile.x, tile.y)
     entity.location = tile
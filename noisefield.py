@@ -0,0 +1,101 @@
+from functools import lru_cache
+from numpy import array
+from numpy import float32
+from numpy import floor
+from numpy import int64
+from numpy import mgrid
+from numpy import where
+from numpy import zeros
+
+
+# array version of noise.snoise2, using the same permutation and gradient tables and the same single precision
+# arithmetic so that every value matches the C implementation exactly
+
+permutation = [151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8,
+               99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35,
+               11, 32, 57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134,
+               139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46,
+               245, 40, 244, 102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200,
+               196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123, 5,
+               202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223,
+               183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22, 39,
+               253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228, 251, 34, 242, 193,
+               238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181,
+               199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114, 67,
+               29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180]
+
+perm = array(permutation * 2, dtype=int64)
+
+gradients = array([(1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (-1, 0),
+                   (1, 0), (-1, 0), (0, 1), (0, -1), (0, 1), (0, -1)], dtype=float32)
+
+F2 = float32(0.3660254037844386)  # 0.5 * (sqrt(3) - 1)
+G2 = float32(0.21132486540518713)  # (3 - sqrt(3)) / 6
+
+
+def simplex2(x, y):
+    x = x.astype(float32)
+    y = y.astype(float32)
+
+    # skew into simplex space to find the containing triangle
+    s = (x + y) * F2
+    i = floor(x + s)
+    j = floor(y + s)
+    t = (i + j) * G2
+
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+
+    i1 = (x0 > y0).astype(int64)
+    j1 = 1 - i1
+
+    x1 = x0 - i1.astype(float32) + G2
+    y1 = y0 - j1.astype(float32) + G2
+    x2 = x0 + G2 * float32(2.0) - float32(1.0)
+    y2 = y0 + G2 * float32(2.0) - float32(1.0)
+
+    ii = i.astype(int64) & 255
+    jj = j.astype(int64) & 255
+
+    corners = [(x0, y0, perm[ii + perm[jj]] % 12),
+               (x1, y1, perm[ii + i1 + perm[jj + j1]] % 12),
+               (x2, y2, perm[ii + 1 + perm[jj + 1]] % 12)]
+
+    total = zeros(x.shape, dtype=float32)
+    for cx, cy, g in corners:
+        f = float32(0.5) - cx * cx - cy * cy
+        contribution = f * f * f * f * (gradients[g, 0] * cx + gradients[g, 1] * cy)
+        total += where(f > 0, contribution, float32(0))
+
+    return total * float32(70.0)
+
+
+@lru_cache(maxsize=32)
+def noise_field(width: int, height: int, scale: float, octaves: int = 1, offset: (int, int) = (0, 0),
+                persistence: float = 0.5, lacunarity: float = 2.0):
+    # snoise2(x * scale, y * scale, octaves) for every tile of a width x height window whose top left tile is offset.
+    # results are cached and shared, so they are handed out read-only
+    ys, xs = mgrid[offset[1]:offset[1] + height, offset[0]:offset[0] + width]
+    x = (xs * scale).astype(float32)
+    y = (ys * scale).astype(float32)
+
+    if octaves <= 1:
+        field = simplex2(x, y)
+    else:
+        freq = float32(1.0)
+        amp = float32(1.0)
+        peak = float32(0.0)
+        field = zeros(x.shape, dtype=float32)
+
+        for i in range(0, octaves):
+            field += simplex2(x * freq, y * freq) * amp
+            peak += amp
+            freq *= float32(lacunarity)
+            amp *= float32(persistence)
+
+        field /= peak
+
+    field = field.astype(float)
+    field.flags.writeable = False
+
+    return field
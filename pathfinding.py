@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from heapq import heappush
+from heapq import heappop
+from math import inf
+from math import sqrt
+from chunkworld import ChunkedWorld
+from worldgrid import tile_types
+
+
+# shortest paths over the tile grid. a unit only crosses tiles of its own terrain type, a step to one of the 8
+# neighbours costs its length, and climbing costs climb_cost extra per level gained for every unit of length.
+# searches run A* over flat lists of the type and height layers, and recent paths are kept in an LRU cache that is
+# dropped whenever the type or height layers change
+
+climb_cost = 0.5
+path_cache_size = 4096
+
+# chunked worlds are too big to flatten, so a search without a cost limit only looks this far around its ends
+chunked_search_margin = 64
+
+steps = [(dx, dy, 1.0 if dx == 0 or dy == 0 else sqrt(2))
+         for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx != 0 or dy != 0]
+
+
+def octile_distance(dx: int, dy: int):
+    dx = abs(dx)
+    dy = abs(dy)
+    return max(dx, dy) + (sqrt(2) - 1) * min(dx, dy)
+
+
+class Pathfinder:
+    def __init__(self, world_map):
+        self.world_map = world_map
+
+        # (start, goal, terrain, max_cost): (cost, path) or None, least recently used first
+        self.paths = OrderedDict()
+        # (x0, y0, width, height, types, heights) over the whole map, built on first use
+        self.grid = None
+        # counts the clears, so copies of the map made elsewhere can tell when they are stale
+        self.version = 0
+
+    def clear(self):
+        self.paths.clear()
+        self.grid = None
+        self.version += 1
+
+    def get_grid(self, bounds: (int, int, int, int)):
+        world = self.world_map.world
+
+        if isinstance(world, ChunkedWorld):
+            x0, y0, x1, y1 = bounds
+            return (x0, y0, x1 - x0, y1 - y0, world.window_layer('type', x0, y0, x1, y1).ravel().tolist(),
+                    world.window_layer('height', x0, y0, x1, y1).ravel().tolist())
+
+        if self.grid is None:
+            width = self.world_map.generation_dict['width']
+            height = self.world_map.generation_dict['height']
+            self.grid = (0, 0, width, height, self.world_map.get_layer('type').ravel().tolist(),
+                         self.world_map.get_layer('height').ravel().tolist())
+
+        return self.grid
+
+    def search_bounds(self, start: (int, int), goal: (int, int), max_cost: float):
+        # a path costs at least its straight line length, so a cost limit bounds how far a search can get
+        margin = chunked_search_margin if max_cost == inf else int(max_cost) + 1
+        xs = [start[0]] if goal is None else [start[0], goal[0]]
+        ys = [start[1]] if goal is None else [start[1], goal[1]]
+
+        return (max(min(xs) - margin, 0), max(min(ys) - margin, 0),
+                min(max(xs) + margin + 1, self.world_map.generation_dict['width']),
+                min(max(ys) + margin + 1, self.world_map.generation_dict['height']))
+
+    def explore(self, start: (int, int), goal: (int, int), terrain: str, max_cost: float):
+        # A* towards goal, or a plain Dijkstra over everything within max_cost when goal is None
+        x0, y0, width, height, types, heights = self.get_grid(self.search_bounds(start, goal, max_cost))
+        code = tile_types.index(terrain) if terrain in tile_types else -1
+
+        s = (start[1] - y0) * width + start[0] - x0
+        g = -1 if goal is None else (goal[1] - y0) * width + goal[0] - x0
+        gx = 0 if goal is None else goal[0] - x0
+        gy = 0 if goal is None else goal[1] - y0
+
+        costs = {s: 0.0}
+        parents = {s: -1}
+        queue = [(0.0, 0.0, s)]
+
+        while len(queue) > 0:
+            f, cost, i = heappop(queue)
+            if i == g:
+                break
+            if cost > costs[i]:
+                continue
+
+            x = i % width
+            y = i // width
+            for dx, dy, length in steps:
+                nx = x + dx
+                ny = y + dy
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+
+                n = i + dy * width + dx
+                if types[n] != code:
+                    continue
+
+                climb = heights[n] - heights[i]
+                step_cost = cost + (length * (1 + climb_cost * climb) if climb > 0 else length)
+                if step_cost > max_cost + 1e-9 or costs.get(n, inf) <= step_cost:
+                    continue
+
+                costs[n] = step_cost
+                parents[n] = i
+                estimate = 0.0 if goal is None else octile_distance(gx - nx, gy - ny)
+                heappush(queue, (step_cost + estimate, step_cost, n))
+
+        return (x0, y0, width), costs, parents
+
+    def find_path(self, start: (int, int), goal: (int, int), terrain: str, max_cost: float = inf):
+        # (cost, [(x, y), ...] from start to goal), or None when the goal cannot be reached within max_cost
+        key = (start, goal, terrain, max_cost)
+        if key in self.paths:
+            self.paths.move_to_end(key)
+            return self.paths[key]
+
+        (x0, y0, width), costs, parents = self.explore(start, goal, terrain, max_cost)
+
+        g = (goal[1] - y0) * width + goal[0] - x0
+        result = None
+        if g in costs:
+            path = []
+            i = g
+            while i != -1:
+                path.append((i % width + x0, i // width + y0))
+                i = parents[i]
+            path.reverse()
+            result = (costs[g], path)
+
+        self.paths[key] = result
+        if len(self.paths) > path_cache_size:
+            self.paths.popitem(last=False)
+
+        return result
+
+    def reachable(self, start: (int, int), terrain: str, max_cost: float):
+        # cheapest cost to every tile that can be reached from start within max_cost, keyed by (x, y)
+        (x0, y0, width), costs, parents = self.explore(start, None, terrain, max_cost)
+
+        return {(i % width + x0, i // width + y0): cost for i, cost in costs.items()}
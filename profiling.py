@@ -0,0 +1,116 @@
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+
+# lightweight instrumentation: named sections record wall time, call counts and, when tracemalloc is running,
+# the change in traced memory. off until the 'stats on' command turns it on; while disabled a profiled call costs one
+# flag check
+
+enabled = False
+window = 100  # number of recent calls the rolling averages cover
+
+
+class SectionStats:
+    __slots__ = ('calls', 'total', 'recent', 'allocated')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+        self.allocated = deque(maxlen=window)
+
+    def add(self, elapsed: float, allocated: int):
+        self.calls += 1
+        self.total += elapsed
+        self.recent.append(elapsed)
+        self.allocated.append(allocated)
+
+    def mean(self):
+        return sum(self.recent) / len(self.recent) if len(self.recent) > 0 else 0.0
+
+    def last(self):
+        return self.recent[-1] if len(self.recent) > 0 else 0.0
+
+    def mean_allocated(self):
+        return sum(self.allocated) / len(self.allocated) if len(self.allocated) > 0 else 0
+
+
+sections = {}
+
+
+class section:
+    __slots__ = ('name', 'start', 'memory')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if enabled:
+            self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if enabled and hasattr(self, 'start'):
+            elapsed = time.perf_counter() - self.start
+            allocated = tracemalloc.get_traced_memory()[0] - self.memory if tracemalloc.is_tracing() else 0
+            record(self.name, elapsed, allocated)
+        return False
+
+
+def record(name: str, elapsed: float, allocated: int = 0):
+    stats = sections.get(name)
+    if stats is None:
+        stats = sections[name] = SectionStats()
+    stats.add(elapsed, allocated)
+
+
+def profiled(name: str):
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            with section(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def enable(allocations: bool = False):
+    global enabled
+    enabled = True
+
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    sections.clear()
+
+
+def report_lines():
+    lines = []
+    for name in sorted(sections):
+        s = sections[name]
+        line = f'{name}: {s.calls} calls, {s.mean() * 1000:.2f} ms avg, {s.last() * 1000:.2f} ms last'
+        if tracemalloc.is_tracing():
+            line += f', {s.mean_allocated() / 1024:+.1f} KiB'
+        lines.append(line)
+
+    return lines
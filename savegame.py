@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import shutil
+from zipfile import BadZipFile
+from numpy import array
+from numpy import load
+from numpy import save
+from numpy import savez
+import entities
+import game
+import worldstore
+from worldgrid import layer_formats
+
+
+# a save is a directory:
+#   <array>.npy  one raw file per tile grid (every layer plus region_ids and continent_ids). they are opened with
+#                numpy.load(mmap_mode='c') and array grid worlds keep the maps as their layers, so pages are only read
+#                as far as they are touched and changes stay private to the game instead of going back to the save
+#   world.npz    seeds, region and continent tables, generation settings
+#   game.npz     game, faction and entity tables
+# loading rebuilds the objects from these without running any generation stage
+
+save_version = 1
+
+save_dir = os.path.join(os.path.expanduser('~'), '.local', 'share', 'snek-map', 'saves')
+
+# what reading a missing, truncated or foreign save can raise
+load_errors = (OSError, EOFError, ValueError, KeyError, BadZipFile)
+
+grid_arrays = ['layer_' + name for name in layer_formats] + ['region_ids', 'continent_ids']
+
+
+# save names become directory names under save_dir, so they may not reach outside it
+save_name_pattern = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def save_path(name: str):
+    if save_name_pattern.fullmatch(name) is None:
+        raise ValueError(f'invalid save name {name!r}, use letters, digits, - and _')
+
+    return os.path.join(save_dir, name)
+
+
+def check_save_path(path: str):
+    # saves are replaced with rmtree, so only ever touch a directory right inside save_dir
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(save_dir):
+        raise ValueError(f'{path} is not a save in {save_dir}')
+
+
+def game_arrays(game_model: game.Game):
+    factions = game_model.factions
+    faction_index = {id(f): n for n, f in enumerate(factions)}
+
+    arrays = {'version': array(save_version),
+              'turn': array(game_model.turn),
+              'faction_count': array(game_model.faction_count),
+              'color_filter': array(game_model.world_map.color_filter),
+              'faction_icon': array([f.faction_icon for f in factions], dtype='U1'),
+              'faction_color': array([f.color for f in factions], dtype=int),
+              'faction_player': array([f.is_player for f in factions], dtype=bool),
+              'faction_currency': array([f.currency for f in factions], dtype=int),
+              'faction_minerals': array([f.minerals for f in factions], dtype=int),
+              'faction_population': array([f.population for f in factions], dtype=int),
+              'faction_population_cap': array([f.population_cap for f in factions], dtype=int),
+              'faction_origin': array([(f.origin.x, f.origin.y) for f in factions], dtype=int).reshape(-1, 2)}
+
+    # entities are stored in faction order; slot is the position in their tile's list, which the ui cycles through
+    owned = [e for f in factions for e in f.entities]
+    arrays['entity_owner'] = array([faction_index[id(e.owner)] for e in owned], dtype=int)
+    arrays['entity_template'] = array([e.data['name'] for e in owned], dtype='U32')
+    arrays['entity_position'] = array([(e.location.x, e.location.y) for e in owned], dtype=int).reshape(-1, 2)
+    arrays['entity_slot'] = array([e.location.entities.index(e) for e in owned], dtype=int)
+    arrays['entity_used_movement'] = array([getattr(e, 'used_movement', 0) for e in owned], dtype=int)
+
+    return arrays
+
+
+def save_game(game_model: game.Game, path: str):
+    check_save_path(path)
+    world_tables = worldstore.world_arrays(game_model.world_map)
+
+    # write the whole save next to the target and swap it in, so a failed save never clobbers the last good one
+    temp_path = path.rstrip(os.sep) + f'.{os.getpid()}.tmp'
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+
+    for name in grid_arrays:
+        save(os.path.join(temp_path, name + '.npy'), world_tables.pop(name))
+    savez(os.path.join(temp_path, 'world.npz'), **world_tables)
+    savez(os.path.join(temp_path, 'game.npz'), **game_arrays(game_model))
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(temp_path, path)
+
+
+def load_world_arrays(path: str):
+    with load(os.path.join(path, 'world.npz')) as bundle:
+        arrays = {name: bundle[name] for name in bundle.files}
+
+    for name in grid_arrays:
+        arrays[name] = load(os.path.join(path, name + '.npy'), mmap_mode='c')
+
+    return arrays
+
+
+def load_game(game_model: game.Game, path: str):
+    # restores the save into the existing game and world map, so everything holding on to them stays valid
+    with load(os.path.join(path, 'game.npz')) as bundle:
+        tables = {name: bundle[name] for name in bundle.files}
+
+    if int(tables['version']) != save_version:
+        raise ValueError(f'unsupported save version {int(tables["version"])}')
+
+    # everything is read before anything changes, so a broken save leaves the running game alone
+    world_tables = load_world_arrays(path)
+
+    world_map = game_model.world_map
+    worldstore.restore_world(world_map, world_tables)
+    world_map.stage_snapshots = {}
+    world_map.finish_generation()
+    world_map.color_filter = str(tables['color_filter'])
+    world_map.cancel_movement()
+    world_map.anchor = world_map.selected_tile
+
+    game_model.turn = int(tables['turn'])
+    game_model.faction_count = int(tables['faction_count'])
+    game_model.factions = []
+
+    for n in range(0, len(tables['faction_icon'])):
+        x, y = tables['faction_origin'][n].tolist()
+        f = game.Faction(str(tables['faction_icon'][n]), int(tables['faction_color'][n]), world_map.world[y][x])
+        f.is_player = bool(tables['faction_player'][n])
+        f.currency = int(tables['faction_currency'][n])
+        f.minerals = int(tables['faction_minerals'][n])
+        f.population = int(tables['faction_population'][n])
+        f.population_cap = int(tables['faction_population_cap'][n])
+        game_model.factions.append(f)
+
+    placed = []
+    for n in range(0, len(tables['entity_owner'])):
+        owner = game_model.factions[int(tables['entity_owner'][n])]
+        x, y = tables['entity_position'][n].tolist()
+        tile = world_map.world[y][x]
+
+        e = entities.create_entity(owner, tile, entities.templates[str(tables['entity_template'][n])])
+        if isinstance(e, entities.Unit):
+            e.used_movement = int(tables['entity_used_movement'][n])
+        owner.add_entity(e)
+        placed.append((int(tables['entity_slot'][n]), n, e))
+
+    # refill the tile lists in their saved order
+    for slot, n, e in sorted(placed, key=lambda p: p[:2]):
+        e.location.entity_index.add(e, e.location.x, e.location.y)
+
+
+def save_names():
+    if not os.path.isdir(save_dir):
+        return []
+
+    return sorted(n for n in os.listdir(save_dir)
+                  if save_name_pattern.fullmatch(n) and os.path.exists(os.path.join(save_dir, n, 'game.npz')))
+
+
+def describe_save(path: str):
+    with load(os.path.join(path, 'world.npz')) as bundle:
+        generation = json.loads(str(bundle['generation']))
+        seed = int(bundle['seed'])
+    with load(os.path.join(path, 'game.npz')) as bundle:
+        turn = int(bundle['turn'])
+
+    return f'{generation["width"]}x{generation["height"]}, seed {seed}, turn {turn}'
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from random import Random
+import numpy
+# game has to come before entities, which imports it back
+import game
+import entities
+import voromap
+from benchmark import current_commit
+
+
+# usage:
+#   python simulate.py --turns 200 --factions 2 6 12 --structures 0 1000 10000 --out sim.json
+#   python simulate.py --size 400x200 --seed-count 1000 --turns 50 --trace-memory
+#   python simulate.py --factions 12 --ai-workers 4 --turns 100
+#
+# plays whole games without a ui: every turn the player faction moves its units to a random reachable tile and may
+# build where they stand, then the turn is ended and the next one started, exactly like the 'end' command does.
+# the other factions take their turns in Game.end_turn, so their planning shows up in the end_turn phase
+
+phases = ['player', 'end_turn', 'start_turn']
+
+
+def percentiles(samples: [float]):
+    values = numpy.percentile(samples, [50, 90, 99])
+    return {'p50': float(values[0]), 'p90': float(values[1]), 'p99': float(values[2]), 'max': max(samples)}
+
+
+def setup_game(width: int, height: int, seed_count: int, faction_count: int, structures: int, seed: int):
+    voromap.WorldMap.cache_dir = None
+
+    world_map = voromap.WorldMap(width, height, 0, 3, 9, seed_count, seed=seed)
+    game_model = game.Game(world_map, faction_count)
+
+    # spread extra structures over each faction's continent so turns have something to add up
+    rng = Random(f'{seed}:structures')
+    kinds = [entities.mine_structure, entities.solar_structure, entities.population_structure]
+    for f in game_model.factions:
+        for i in range(0, structures):
+            game.create_owned_entity(f, world_map.get_random_land_tile(rng), rng.choice(kinds))
+
+    return world_map, game_model
+
+
+def play_player(world_map: voromap.WorldMap, game_model: game.Game, rng: Random, build_chance: float):
+    for f in [f for f in game_model.factions if f.is_player]:
+        for u in list(f.units):
+            here = (u.location.x, u.location.y)
+            destinations = sorted(p for p in world_map.reachable_tiles(u.location, u) if p != here)
+            if len(destinations) > 0:
+                x, y = rng.choice(destinations)
+                world_map.move_entity(u, u.location, world_map.tile_at_point(x, y))
+
+            # what the number keys do in the entity view
+            if 'constructs' in u.data and rng.random() < build_chance:
+                game.create_owned_entity(f, u.location, rng.choice(u.data['constructs']))
+
+
+def run_case(width: int, height: int, seed_count: int, faction_count: int, structures: int, turns: int, seed: int,
+             build_chance: float, trace_memory: bool):
+    world_map, game_model = setup_game(width, height, seed_count, faction_count, structures, seed)
+    rng = Random(f'{seed}:turns')
+
+    if trace_memory:
+        tracemalloc.start()
+
+    samples = {name: [] for name in phases}
+    totals = []
+    start = time.perf_counter()
+    for i in range(0, turns):
+        turn_start = time.perf_counter()
+
+        play_player(world_map, game_model, rng, build_chance)
+        player_done = time.perf_counter()
+        game_model.end_turn()
+        end_done = time.perf_counter()
+        game_model.start_turn()
+        start_done = time.perf_counter()
+
+        samples['player'].append(player_done - turn_start)
+        samples['end_turn'].append(end_done - player_done)
+        samples['start_turn'].append(start_done - end_done)
+        totals.append(start_done - turn_start)
+    elapsed = time.perf_counter() - start
+
+    case = {'width': width, 'height': height, 'seed_count': seed_count, 'factions': faction_count,
+            'structures': structures, 'turns': turns,
+            'entities': sum(len(f.entities) for f in game_model.factions),
+            'turns_per_second': turns / elapsed if elapsed > 0 else None,
+            'turn': percentiles(totals),
+            'phases': {name: percentiles(samples[name]) for name in phases},
+            # peak resident size of the whole process so far, in KiB on linux
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    if trace_memory:
+        case['traced_peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return case
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play games without a ui and time every turn.')
+    parser.add_argument('--size', default='80x40', help='map size as WIDTHxHEIGHT')
+    parser.add_argument('--seed-count', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--turns', type=int, default=100)
+    parser.add_argument('--factions', nargs='+', type=int, default=[6],
+                        help=f'faction counts to run, at most {len(game.faction_colors)}')
+    parser.add_argument('--structures', nargs='+', type=int, default=[0],
+                        help='extra structures every faction starts with')
+    parser.add_argument('--build-chance', type=float, default=0.5,
+                        help='chance that a unit builds something every turn')
+    parser.add_argument('--ai-workers', type=int, default=None,
+                        help='worker processes that plan the turns of the other factions; by default one per '
+                             'faction, up to the number of cpus')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report the peak of traced allocations; slows every turn down')
+    parser.add_argument('--out', help='write results as JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if max(args.factions) > len(game.faction_colors):
+        parser.error(f'at most {len(game.faction_colors)} factions are supported')
+
+    width, height = (int(i) for i in args.size.lower().split('x'))
+    game.Game.ai_workers = args.ai_workers
+
+    results = []
+    for faction_count in args.factions:
+        for structures in args.structures:
+            case = run_case(width, height, args.seed_count, faction_count, structures, args.turns, args.seed,
+                            args.build_chance, args.trace_memory)
+            results.append(case)
+            print(f'{faction_count} factions, {structures} structures: {case["turns_per_second"]:.1f} turns/s, '
+                  f'p50 {case["turn"]["p50"] * 1000:.2f} ms, p99 {case["turn"]["p99"] * 1000:.2f} ms, '
+                  f'{case["entities"]} entities at the end', file=sys.stderr)
+
+    report = {'commit': current_commit(), 'python': platform.python_version(), 'numpy': numpy.__version__,
+              'machine': platform.machine(), 'cpus': os.cpu_count(), 'ai_workers': args.ai_workers, 'seed': args.seed,
+              'results': results}
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
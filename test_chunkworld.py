@@ -0,0 +1,51 @@
+import pytest
+from numpy import array_equal
+import voromap
+from chunkworld import ChunkedWorld
+from worldgrid import layer_formats
+
+
+@pytest.fixture(autouse=True)
+def no_world_cache(monkeypatch):
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', None)
+
+
+def whole_layers(world_map: voromap.WorldMap):
+    return {name: world_map.whole_layer(name).copy() for name in list(layer_formats) + ['region_ids', 'continent_ids']}
+
+
+@pytest.mark.parametrize('width, height, seed, chunk_size, cache_size', [(80, 40, 3, 16, 256),
+                                                                         (97, 53, 5, 10, 3),
+                                                                         (150, 90, 11, 32, 2)])
+def test_chunks_match_a_full_world(monkeypatch, width, height, seed, chunk_size, cache_size):
+    full = whole_layers(voromap.WorldMap(width, height, 0, 3, 9, 100, seed=seed))
+
+    monkeypatch.setitem(voromap.WorldMap.generation_dict, 'chunk_size', chunk_size)
+    monkeypatch.setattr(voromap.WorldMap, 'chunk_cache_size', cache_size)
+    world_map = voromap.WorldMap(width, height, 0, 3, 9, 100, seed=seed)
+    assert isinstance(world_map.world, ChunkedWorld)
+
+    chunked = whole_layers(world_map)
+    for name, values in full.items():
+        assert array_equal(chunked[name], values), name
+    assert len(world_map.world.chunks) <= cache_size
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_edited_chunks_survive_eviction(monkeypatch, tmp_path, spill):
+    monkeypatch.setitem(voromap.WorldMap.generation_dict, 'chunk_size', 10)
+    monkeypatch.setattr(voromap.WorldMap, 'chunk_cache_size', 1)
+    monkeypatch.setattr(voromap.WorldMap, 'chunk_spill_dir', str(tmp_path) if spill else None)
+    world_map = voromap.WorldMap(40, 20, 0, 3, 9, 100, seed=3)
+    world = world_map.world
+    heights = world.layers['height']
+
+    world.clear()
+    heights[0, 0] = 41
+    heights[0, 15] = 42
+    # reading another chunk must not push out the edits either
+    heights[15, 35]
+
+    assert heights[0, 0] == 41
+    assert heights[0, 15] == 42
+    assert world.modified <= set(world.chunks)
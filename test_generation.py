@@ -0,0 +1,61 @@
+import pytest
+from numpy import array_equal
+import voromap
+from worldgrid import layer_formats
+
+
+@pytest.fixture(autouse=True)
+def own_generation_settings(monkeypatch):
+    # the settings live on the class, so every test gets a copy to change
+    monkeypatch.setattr(voromap.WorldMap, 'generation_dict', dict(voromap.WorldMap.generation_dict))
+
+
+def new_world(seed: int):
+    settings = voromap.WorldMap.generation_dict
+    return voromap.WorldMap(80, 40, settings['min_altitude'], settings['sea_level'], settings['max_altitude'], 100,
+                            seed=seed)
+
+
+def world_values(world_map: voromap.WorldMap):
+    values = {name: world_map.whole_layer(name).copy()
+              for name in list(layer_formats) + ['region_ids', 'continent_ids']}
+    values['continents'] = [(c.icon, sorted(r.seed_index for r in c.regions)) for c in world_map.continents]
+    return values
+
+
+def assert_same_world(world_map: voromap.WorldMap, expected: dict):
+    got = world_values(world_map)
+    assert got['continents'] == expected['continents']
+    for name in expected:
+        if name != 'continents':
+            assert array_equal(got[name], expected[name]), name
+
+
+@pytest.mark.parametrize('key, value, stage', [('noise_weight', 6, 'noise'),
+                                               ('sea_level', 5, 'regions'),
+                                               ('max_temp', 2, 'climate')])
+@pytest.mark.parametrize('from_cache', [False, True])
+def test_replayed_settings_match_a_fresh_world(monkeypatch, tmp_path, key, value, stage, from_cache):
+    if from_cache:
+        monkeypatch.setattr(voromap.WorldMap, 'cache_dir', str(tmp_path))
+        new_world(6)
+
+    world_map = new_world(6)
+    if from_cache:
+        # a world that came out of the cache has nothing to replay from and falls back to a full run
+        assert world_map.stage_snapshots == {}
+
+    assert world_map.update_generation({key: value}) == stage
+
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', None)
+    expected = new_world(6)
+    assert expected.generation_dict[key] == value
+    assert_same_world(world_map, world_values(expected))
+
+
+def test_unknown_settings_change_nothing():
+    world_map = new_world(6)
+    before = world_values(world_map)
+
+    assert world_map.update_generation({'fuzz_percent': 7}) is None
+    assert_same_world(world_map, before)
@@ -0,0 +1,145 @@
+from math import sqrt
+import pytest
+from numpy import array
+from numpy import full
+# game has to come before entities, which imports it back
+import game
+import pathfinding
+import voromap
+from pathfinding import Pathfinder
+from worldgrid import tile_types
+
+
+land = tile_types.index('Land')
+sea = tile_types.index('Sea')
+
+
+class FakeMap:
+    # just what a Pathfinder reads from a WorldMap
+    world = None
+
+    def __init__(self, types, heights):
+        self.layers = {'type': array(types, dtype='u1'), 'height': array(heights, dtype='i2')}
+        self.generation_dict = {'width': self.layers['type'].shape[1], 'height': self.layers['type'].shape[0]}
+
+    def get_layer(self, name: str):
+        return self.layers[name]
+
+
+def flat_map(width: int, height: int):
+    return FakeMap(full((height, width), land), full((height, width), 0))
+
+
+def test_straight_and_diagonal_steps():
+    pathfinder = Pathfinder(flat_map(5, 5))
+
+    cost, path = pathfinder.find_path((0, 0), (3, 0), 'Land')
+    assert cost == pytest.approx(3)
+    assert path == [(0, 0), (1, 0), (2, 0), (3, 0)]
+
+    cost, path = pathfinder.find_path((0, 0), (2, 2), 'Land')
+    assert cost == pytest.approx(2 * sqrt(2))
+    assert path == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_only_own_terrain_is_crossed():
+    world_map = flat_map(5, 3)
+    world_map.layers['type'][:, 2] = sea
+    pathfinder = Pathfinder(world_map)
+
+    assert pathfinder.find_path((0, 1), (4, 1), 'Land') is None
+    assert (4, 1) not in pathfinder.reachable((0, 1), 'Land', 10)
+
+    # a gap in the sea is the only way across
+    world_map.layers['type'][2, 2] = land
+    pathfinder.clear()
+    cost, path = pathfinder.find_path((0, 1), (4, 1), 'Land')
+    assert (2, 2) in path
+    assert cost == pytest.approx(2 + 2 * sqrt(2))
+
+    assert pathfinder.find_path((2, 0), (2, 1), 'Sea') == (1.0, [(2, 0), (2, 1)])
+
+
+def test_climbing_costs_extra():
+    world_map = FakeMap([[land, land, land]], [[0, 2, 1]])
+    pathfinder = Pathfinder(world_map)
+
+    # up two levels, then down one for free
+    cost, path = pathfinder.find_path((0, 0), (2, 0), 'Land')
+    assert cost == pytest.approx(1 + pathfinding.climb_cost * 2 + 1)
+
+    cost, path = pathfinder.find_path((2, 0), (0, 0), 'Land')
+    assert cost == pytest.approx(1 + pathfinding.climb_cost * 1 + 1)
+
+
+def test_max_cost_limits_paths():
+    pathfinder = Pathfinder(flat_map(6, 1))
+
+    assert pathfinder.find_path((0, 0), (5, 0), 'Land', 4) is None
+    assert pathfinder.find_path((0, 0), (4, 0), 'Land', 4)[0] == pytest.approx(4)
+    assert sorted(pathfinder.reachable((0, 0), 'Land', 2)) == [(0, 0), (1, 0), (2, 0)]
+
+
+def test_path_costs_match_reachable():
+    types = [[land if (x * 7 + y * 3) % 5 != 0 else sea for x in range(0, 12)] for y in range(0, 9)]
+    heights = [[(x * x + y * 5) % 4 for x in range(0, 12)] for y in range(0, 9)]
+    pathfinder = Pathfinder(FakeMap(types, heights))
+
+    start = (1, 1)
+    reachable = pathfinder.reachable(start, 'Land', 8)
+    assert len(reachable) > 10
+
+    for position, cost in reachable.items():
+        found = pathfinder.find_path(start, position, 'Land')
+        assert found is not None
+        assert found[0] == pytest.approx(cost)
+        assert found[1][0] == start and found[1][-1] == position
+
+
+def test_clear_drops_cached_paths():
+    world_map = flat_map(4, 1)
+    pathfinder = Pathfinder(world_map)
+    assert pathfinder.find_path((0, 0), (3, 0), 'Land')[0] == pytest.approx(3)
+
+    # the cache and the flattened grid still answer for the old map until they are cleared
+    world_map.layers['type'][0, 1] = sea
+    assert pathfinder.find_path((0, 0), (3, 0), 'Land')[0] == pytest.approx(3)
+
+    version = pathfinder.version
+    pathfinder.clear()
+    assert pathfinder.version == version + 1
+    assert len(pathfinder.paths) == 0
+    assert pathfinder.find_path((0, 0), (3, 0), 'Land') is None
+
+
+def test_cache_keeps_most_recent_paths(monkeypatch):
+    monkeypatch.setattr(pathfinding, 'path_cache_size', 2)
+    pathfinder = Pathfinder(flat_map(4, 1))
+
+    pathfinder.find_path((0, 0), (1, 0), 'Land')
+    pathfinder.find_path((0, 0), (2, 0), 'Land')
+    pathfinder.find_path((0, 0), (1, 0), 'Land')
+    pathfinder.find_path((0, 0), (3, 0), 'Land')
+
+    assert [key[1] for key in pathfinder.paths] == [(1, 0), (3, 0)]
+
+
+def test_moves_only_spend_the_movement_left(monkeypatch):
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', None)
+
+    world_map = voromap.WorldMap(80, 40, 0, 3, 9, 100, seed=3)
+    game_model = game.Game(world_map, 2)
+    unit = game_model.factions[0].units[0]
+    assert unit.data['move_distance'] == 2
+
+    reachable = world_map.reachable_tiles(unit.location, unit)
+    step = min(p for p, cost in reachable.items() if cost == 1)
+    assert world_map.move_entity(unit, unit.location, world_map.tile_at_point(*step))
+    assert unit.used_movement == 1
+
+    reachable = world_map.reachable_tiles(unit.location, unit)
+    assert max(reachable.values()) <= 1
+    far = [p for p, cost in world_map.pathfinder.reachable(step, 'Land', 2).items() if cost > 1]
+    assert len(far) > 0
+    assert not world_map.move_entity(unit, unit.location, world_map.tile_at_point(*far[0]))
+    assert unit.used_movement == 1
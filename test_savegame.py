@@ -0,0 +1,143 @@
+import os
+import pytest
+from numpy import array
+from numpy import array_equal
+from numpy import load
+from numpy import savez
+# game has to come before entities, which imports it back
+import game
+import entities
+import savegame
+import voromap
+from worldgrid import layer_formats
+
+
+@pytest.fixture(autouse=True)
+def no_world_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', None)
+    monkeypatch.setattr(savegame, 'save_dir', str(tmp_path / 'saves'))
+
+
+def new_game(seed: int, faction_count: int):
+    world_map = voromap.WorldMap(80, 40, 0, 3, 9, 100, seed=seed)
+    return game.Game(world_map, faction_count)
+
+
+def faction_values(game_model: game.Game):
+    return [(f.faction_icon, f.color, f.is_player, f.currency, f.minerals, f.population, f.population_cap,
+             (f.origin.x, f.origin.y)) for f in game_model.factions]
+
+
+def entity_values(game_model: game.Game):
+    factions = game_model.factions
+    return [[(e.data['name'], (e.location.x, e.location.y), e.location.entities.index(e),
+              getattr(e, 'used_movement', None)) for e in f.entities] for f in factions]
+
+
+def tile_values(world_map: voromap.WorldMap):
+    return [((x, y), [(e.owner.faction_icon, e.data['name']) for e in tile_entities])
+            for (x, y), tile_entities in sorted(world_map.entity_index.items())]
+
+
+def test_round_trip():
+    saved = new_game(3, 4)
+    world_map = saved.world_map
+    saved.ai_workers = 1
+    for i in range(0, 3):
+        saved.end_turn()
+        saved.start_turn()
+
+    # move the player's unit part of the way so there is movement to restore
+    unit = saved.factions[0].units[0]
+    reachable = world_map.reachable_tiles(unit.location, unit)
+    x, y = min((p for p in reachable if reachable[p] >= 1), key=lambda p: (reachable[p], p[1], p[0]))
+    assert world_map.move_entity(unit, unit.location, world_map.tile_at_point(x, y))
+    game.create_owned_entity(saved.factions[0], unit.location, entities.solar_structure)
+    assert unit.used_movement > 0
+
+    path = savegame.save_path('save')
+    savegame.save_game(saved, path)
+
+    layers = {name: world_map.get_layer(name).copy() for name in layer_formats}
+    region_ids = world_map.region_ids.copy()
+    continent_ids = world_map.continent_ids.copy()
+    factions = faction_values(saved)
+    placed = entity_values(saved)
+    tiles = tile_values(world_map)
+
+    loaded = new_game(8, 2)
+    savegame.load_game(loaded, path)
+
+    assert loaded.turn == saved.turn
+    assert faction_values(loaded) == factions
+    assert entity_values(loaded) == placed
+    assert tile_values(loaded.world_map) == tiles
+    for name in layer_formats:
+        assert array_equal(loaded.world_map.get_layer(name), layers[name]), name
+    assert array_equal(loaded.world_map.region_ids, region_ids)
+    assert array_equal(loaded.world_map.continent_ids, continent_ids)
+
+    # the loaded game plays on from the same ledger totals
+    assert [f.energy_balance() for f in loaded.factions] == [f.energy_balance() for f in saved.factions]
+
+
+def test_loaded_grids_stay_private():
+    saved = new_game(5, 2)
+    path = savegame.save_path('save')
+    savegame.save_game(saved, path)
+
+    loaded = new_game(5, 2)
+    savegame.load_game(loaded, path)
+    heights = loaded.world_map.get_layer('height')
+    before = heights[0, 0]
+    heights[0, 0] = before + 1
+
+    # the maps are copy on write, so the edit never reaches the save
+    assert savegame.load_world_arrays(path)['layer_height'][0, 0] == before
+
+
+@pytest.mark.parametrize('name', ['..', '.', '', '/', '/etc', '../saves', 'a/b', 'a b', '~'])
+def test_save_names_stay_inside_save_dir(name):
+    with pytest.raises(ValueError):
+        savegame.save_path(name)
+
+
+def test_save_refuses_paths_outside_save_dir(tmp_path):
+    saved = new_game(5, 2)
+    outside = tmp_path / 'elsewhere'
+    outside.mkdir()
+    (outside / 'keep').write_text('')
+
+    for path in [str(outside), savegame.save_dir, str(tmp_path / 'saves' / 'a' / 'b')]:
+        with pytest.raises(ValueError):
+            savegame.save_game(saved, path)
+    assert (outside / 'keep').exists()
+
+
+def test_broken_saves_leave_the_game_alone():
+    saved = new_game(5, 2)
+    path = savegame.save_path('save')
+    savegame.save_game(saved, path)
+
+    loaded = new_game(7, 3)
+    factions = faction_values(loaded)
+    heights = loaded.world_map.get_layer('height').copy()
+
+    world_file = os.path.join(path, 'world.npz')
+    with open(world_file, 'rb') as f:
+        data = f.read()
+    with open(world_file, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(savegame.load_errors):
+        savegame.load_game(loaded, path)
+
+    game_file = os.path.join(path, 'game.npz')
+    with load(game_file) as bundle:
+        tables = {name: bundle[name] for name in bundle.files}
+    tables['version'] = array(savegame.save_version + 1)
+    savez(game_file, **tables)
+    with pytest.raises(ValueError, match='unsupported save version'):
+        savegame.load_game(loaded, path)
+
+    assert faction_values(loaded) == factions
+    assert array_equal(loaded.world_map.get_layer('height'), heights)
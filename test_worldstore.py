@@ -0,0 +1,47 @@
+import os
+from numpy import array_equal
+import voromap
+import worldstore
+from worldgrid import layer_formats
+
+
+def whole_layers(world_map: voromap.WorldMap):
+    return {name: world_map.whole_layer(name).copy() for name in list(layer_formats) + ['region_ids', 'continent_ids']}
+
+
+def test_cache_is_off_by_default():
+    assert voromap.WorldMap.cache_dir is None
+
+
+def test_cached_worlds_match_generated_ones(monkeypatch, tmp_path):
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', str(tmp_path))
+
+    generated = voromap.WorldMap(80, 40, 0, 3, 9, 100, seed=4)
+    layers = whole_layers(generated)
+    assert len(os.listdir(tmp_path)) == 1
+
+    # a cache hit restores the world without taking stage snapshots
+    cached = voromap.WorldMap(80, 40, 0, 3, 9, 100, seed=4)
+    assert cached.stage_snapshots == {}
+    for name, values in whole_layers(cached).items():
+        assert array_equal(values, layers[name]), name
+    assert [c.icon for c in cached.continents] == [c.icon for c in generated.continents]
+
+
+def test_cache_keeps_the_most_recently_used_worlds(monkeypatch, tmp_path):
+    monkeypatch.setattr(voromap.WorldMap, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(worldstore, 'cache_size', 2)
+
+    world_map = voromap.WorldMap(40, 20, 0, 3, 9, 30, seed=1)
+    first = worldstore.cached_world_path(str(tmp_path), world_map.generation_dict, 1)
+    os.utime(first, (0, 0))
+
+    world_map.regenerate(2)
+    os.utime(worldstore.cached_world_path(str(tmp_path), world_map.generation_dict, 2), (1, 1))
+    # loading seed 1 again makes it the most recently used
+    world_map.regenerate(1)
+    world_map.regenerate(3)
+
+    kept = sorted(os.listdir(tmp_path))
+    assert len(kept) == 2
+    assert os.path.basename(first) in kept
@@ -0,0 +1,115 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from numpy import ndarray
+import voromap
+
+
+# runs the per tile generation steps over row blocks in a process pool. the layers a step touches are copied into
+# shared memory once, every worker reads and writes its own rows in place, and the results are copied back.
+# blocks use the same WorldMap window helpers as the single process path, so the output is identical
+
+# layers each step reads and writes
+step_layers = {'noise': ['height'],
+               'smoothing': ['height'],
+               'sea': ['type', 'height'],
+               'truncate': ['height'],
+               'heat': ['temperature'],
+               'precipitation': ['temperature', 'precipitation']}
+
+# blocks per worker, so that a slow block does not leave the other workers idle at the end
+blocks_per_worker = 4
+
+pool = None
+pool_workers = 0
+
+
+def get_pool(workers: int):
+    global pool, pool_workers
+
+    if pool is None or pool_workers != workers:
+        if pool is not None:
+            pool.shutdown()
+        pool = ProcessPoolExecutor(max_workers=workers)
+        pool_workers = workers
+
+    return pool
+
+
+def row_blocks(height: int, count: int, minimum_rows: int):
+    rows = max(-(-height // count), minimum_rows)
+    return [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+
+def run_step(world_map, step: str, workers: int):
+    names = list(step_layers[step])
+    if step == 'smoothing':
+        # smoothing reads neighbouring rows that other blocks are writing, so it writes to a second buffer
+        names.append('smoothed')
+
+    height = world_map.generation_dict['height']
+    halo = world_map.smoothing_halo()
+
+    blocks = {}
+    arrays = {}
+    try:
+        for name in names:
+            values = world_map.get_layer('height' if name == 'smoothed' else name)
+            blocks[name] = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            arrays[name] = ndarray(values.shape, values.dtype, buffer=blocks[name].buf)
+            arrays[name][...] = values
+
+        layout = {name: (blocks[name].name, arrays[name].shape, arrays[name].dtype.str) for name in names}
+        settings = dict(world_map.generation_dict)
+
+        futures = [get_pool(workers).submit(run_block, step, layout, settings, y0, y1)
+                   for y0, y1 in row_blocks(height, workers * blocks_per_worker, halo)]
+        for f in futures:
+            f.result()
+
+        for name in step_layers[step]:
+            world_map.set_layer(name, arrays['smoothed' if step == 'smoothing' else name])
+    finally:
+        # the views have to go before the shared memory can be closed
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+
+def run_block(step: str, layout: dict, settings: dict, y0: int, y1: int):
+    # runs in a worker process; a bare WorldMap is enough since the window helpers only read generation settings
+    voromap.WorldMap.generation_dict.update(settings)
+    world_map = voromap.WorldMap.__new__(voromap.WorldMap)
+
+    blocks = {}
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        blocks[name] = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = ndarray(shape, dtype, buffer=blocks[name].buf)
+
+    try:
+        width = settings['width']
+        window = (0, y0, width, y1 - y0)
+
+        if step == 'noise':
+            heights = arrays['height']
+            heights[y0:y1] = world_map.noise_heights(heights[y0:y1], window)
+        elif step == 'smoothing':
+            halo = world_map.smoothing_halo()
+            h0 = max(y0 - halo, 0)
+            h1 = min(y1 + halo, settings['height'])
+            arrays['smoothed'][y0:y1] = world_map.smooth_heights(arrays['height'][h0:h1])[y0 - h0:y1 - h0]
+        elif step == 'sea':
+            types, heights = world_map.sea_layers(arrays['type'][y0:y1], arrays['height'][y0:y1])
+            arrays['type'][y0:y1] = types
+            arrays['height'][y0:y1] = heights
+        elif step == 'truncate':
+            arrays['height'][y0:y1] = world_map.truncated_heights(arrays['height'][y0:y1])
+        elif step == 'heat':
+            arrays['temperature'][y0:y1] = world_map.heat_values(window)
+        elif step == 'precipitation':
+            arrays['precipitation'][y0:y1] = world_map.precipitation_values(arrays['temperature'][y0:y1], window)
+    finally:
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
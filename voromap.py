@@ -1,5 +1,5 @@
-from random import randint
-from random import shuffle
+from random import Random
+from random import randrange
 from asciimatics.screen import Screen
 import matplotlib.path as mplpath
 from math import hypot
@@ -8,8 +8,32 @@ from math import sqrt
 from scipy import spatial
 from scipy.ndimage.filters import gaussian_filter
 from numpy import array
-import noise
-import copy
+from numpy import ndarray
+from numpy import full
+from numpy import mgrid
+from numpy import column_stack
+from numpy import maximum
+from numpy import minimum
+from numpy import clip
+from numpy import select
+from numpy import zeros
+from numpy import rint
+from numpy import hypot as hypot_array
+from numpy import flatnonzero
+from collections import deque
+import os
+import worldstore
+import profiling
+import tiledexec
+from pathfinding import Pathfinder
+from entityindex import EntityIndex
+from noisefield import noise_field
+from chunkworld import ChunkedWorld
+from worldgrid import WorldGrid
+from worldgrid import layer_formats
+from worldgrid import layer_codes
+from worldgrid import tile_types
+from worldgrid import terrain_types
 
 
 # TODO:
@@ -29,6 +53,29 @@ import copy
 #                 ['Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Rainforest', 'Rainforest'],
 #                 ['Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Void', 'Rainforest']]
 
+terrain_colors = {'Forest': [23, 29, 22, 28, 34, 40, 46, 47, 48],
+                  'Ocean': [17, 18, 19, 20, 21, 33, 45, 201, 201, 201],
+                  'Mountain': [201, 201, 201, 233, 235, 237, 241, 248, 252, 255],
+                  'Desert': [3, 186, 190, 226, 227, 228, 229, 230, 252, 255],
+                  'Rainforest': [24, 30, 36, 35, 41, 47, 83, 77],
+                  'Frozen': [63, 69, 75, 81, 87, 253, 255]}
+
+temperature_colors = [15, 195, 87, 86, 84, 46, 40, 190, 226, 184, 178]
+precipitation_colors = [224, 222, 227, 190, 119, 120, 48, 46, 34, 28, 22]
+
+
+def segment_distance(xs: ndarray, ys: ndarray, a: (int, int), b: (int, int)):
+    # distance from every (xs, ys) point to the closest point of the segment a-b
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length = dx * dx + dy * dy
+
+    if length == 0:
+        return hypot_array(xs - a[0], ys - a[1])
+
+    t = clip(((xs - a[0]) * dx + (ys - a[1]) * dy) / length, 0, 1)
+    return hypot_array(xs - (a[0] + t * dx), ys - (a[1] + t * dy))
+
 
 class Tile:
     icon = '~'
@@ -39,22 +86,28 @@ class Tile:
     temperature = 0
     precipitation = 0
 
-    def __init__(self, x: int, y: int, height: int):
+    def __init__(self, x: int, y: int, height: int, entity_index: EntityIndex):
         self.x = x
         self.y = y
         self.height = height
-        self.entities = []
+        self.entity_index = entity_index
+
+    @property
+    def entities(self):
+        return self.entity_index.at(self.x, self.y)
 
 
 class Region:
     terrain = 'None'
 
-    def __init__(self, icon: str, base_height: int, max_height: int, vertices: [[int, int]], tiles: [Tile]):
+    def __init__(self, icon: str, base_height: int, max_height: int, vertices: [[int, int]], tiles: [Tile],
+                 seed_index: int = -1):
         self.icon = icon
         self.base_height = base_height
         self.max_height = max_height
         self.vertices = vertices
         self.tiles = tiles
+        self.seed_index = seed_index  # index of the voronoi point this region was grown from
 
         for t in tiles:
             t.height = self.base_height
@@ -113,10 +166,18 @@ class WorldMap:
     continents: [Continent]
     regions: [Region]
     seeds: [(int, int)]
+    region_ids: ndarray
+    continent_ids: ndarray
+    region_adjacency: {int: {int}}
+    region_index: {int: Region}
+    region_boxes: ndarray
+    ridge_lines: [[((int, int), (int, int))]]
 
     selected_entity = 0
     is_anchored = False
     anchor: Tile
+    # (x, y) of every tile the anchored unit can move to, empty when nothing is anchored
+    movement_range: {(int, int)}
 
     region_letters = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
                       'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l',
@@ -130,15 +191,63 @@ class WorldMap:
                        'seed_count': 100,
                        'fuzz_percent': 5,
                        'mountains_per_continent': 1, 'mountain_range_length': 3,
-                       'continent_count': 4, 'percent_land': 50,
-                       'noise_weight': 3, 'noise_scale': 0.1,
+                       'mountain_width': 1, 'mountain_falloff': 2,
+                       'continent_count': 4, 'percent_land': 50, 'seed_region_spacing': 0,
+                       'noise_weight': 3, 'noise_scale': 0.1, 'noise_octaves': 1,
                        'heat_noise_scale': 0.075, 'max_temp': 7, 'temp_variance': 3, 'min_temp': 3,
-                       'base_precip': 5, 'precip_variance': 5, 'precip_noise_scale': 0.05}
+                       'base_precip': 5, 'precip_variance': 5, 'precip_noise_scale': 0.05,
+                       'array_grid': 1, 'chunk_size': 0}
+
+    # stage name, method, and the generation_dict keys it reads. each stage only builds on the ones before it
+    generation_stages = [('seeds', 'seed_stage', ['width', 'height', 'seed_count']),
+                         ('voronoi', 'voronoi_stage', []),
+                         ('regions', 'region_stage', ['width', 'height', 'min_altitude', 'sea_level', 'max_altitude',
+                                                      'array_grid', 'chunk_size']),
+                         ('continents', 'continent_stage', ['continent_count', 'percent_land', 'seed_region_spacing']),
+                         ('mountains', 'mountain_stage', ['mountains_per_continent', 'mountain_range_length',
+                                                          'mountain_width', 'mountain_falloff', 'max_altitude']),
+                         ('noise', 'noise_stage', ['noise_weight', 'noise_scale', 'noise_octaves']),
+                         ('smoothing', 'smoothing_stage', []),
+                         ('sea', 'sea_stage', ['sea_level', 'min_altitude', 'max_altitude']),
+                         ('climate', 'climate_stage', ['heat_noise_scale', 'max_temp', 'temp_variance', 'min_temp',
+                                                       'base_precip', 'precip_variance', 'precip_noise_scale']),
+                         ('filters', 'filter_stage', [])]
+
+    # stages that replace the tiles, regions and continents rather than editing tile layers
+    structural_stages = ['seeds', 'voronoi', 'regions', 'continents']
+
+    # stages that only work on tile layers; a chunked world runs them per chunk when the chunk is first read
+    tile_stages = ['noise', 'smoothing', 'sea', 'climate', 'filters']
+
+    # with chunk_size above 0 at most this many chunks are kept in memory; evicted chunks are written to a
+    # memory mapped file under chunk_spill_dir, or dropped and generated again when it is None
+    chunk_cache_size = 256
+    chunk_spill_dir = None
+
+    smoothing_sigma = 0.5
+
+    # per tile stages are split into row blocks over this many worker processes once a map has parallel_min_tiles
+    # tiles; below that copying the layers to the workers costs more than it saves
+    tile_workers = 1
+    parallel_min_tiles = 1000000
 
-    selected_tile: Tile
     color_filter = 'Terrain'
 
-    def __init__(self, width: int, height: int, min_altitude: int, sea_level: int, max_altitude: int, seed_count: int):
+    # tiles whose look on the map changed since the map view last drew them, as (x, y); redraw_all stands for every
+    # tile, e.g. after a layer was rewritten
+    dirty_tiles: {(int, int)}
+    redraw_all = True
+
+    seed: int
+    rng: Random
+
+    # finished worlds are stored here keyed by their generation settings and seed, e.g. in default_cache_dir. off by
+    # default, as every new seed adds a file; worldstore.cache_size bounds how many are kept
+    cache_dir = None
+    default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'snek-map', 'worlds')
+
+    def __init__(self, width: int, height: int, min_altitude: int, sea_level: int, max_altitude: int, seed_count: int,
+                 seed: int = None):
         self.generation_dict['width'] = width
         self.generation_dict['height'] = height
         self.generation_dict['min_altitude'] = min_altitude
@@ -146,16 +255,18 @@ class WorldMap:
         self.generation_dict['sea_level'] = sea_level
         self.generation_dict['seed_count'] = seed_count
 
-        self.seeds = []
-        self.set_seeds()
+        self.rng = Random(seed)
 
-        self.voronoi_diagram = spatial.Voronoi(self.seeds)
-        self.world = self.create_base_map(self.generation_dict['width'], self.generation_dict['height'],
-                                          self.generation_dict['min_altitude'])
+        self.seeds = []
         self.regions = []
         self.continents = []
+        self.stage_snapshots = {}
+        self.ridge_lines = []
+        self.dirty_tiles = set()
+        self.movement_range = set()
+        self.pathfinder = Pathfinder(self)
 
-        self.regenerate()
+        self.regenerate(seed)
 
         self.selected_tile = self.tile_at_point(0, 0)
 
@@ -163,60 +274,202 @@ class WorldMap:
 
         self.anchor = self.tile_at_point(0, 0)
 
+    @property
+    def selected_tile(self):
+        return self._selected_tile
+
+    @selected_tile.setter
+    def selected_tile(self, tile):
+        if getattr(self, '_selected_tile', None) is not None:
+            self.mark_dirty(self._selected_tile)
+
+        self._selected_tile = tile
+        self.mark_dirty(tile)
+
+    def mark_dirty(self, tile):
+        self.dirty_tiles.add((tile.x, tile.y))
+
+    def mark_all_dirty(self):
+        self.redraw_all = True
+        self.dirty_tiles = set()
+
+    def take_dirty(self):
+        # hands everything that changed since the last call to the map view
+        redraw_all, dirty_tiles = self.redraw_all, self.dirty_tiles
+        self.redraw_all = False
+        self.dirty_tiles = set()
+
+        return redraw_all, dirty_tiles
+
     # basic generation methods
 
-    def regenerate(self):
-        self.regions = []
-        self.continents = []
-        self.seeds = []
+    @profiling.profiled('generation.total')
+    def regenerate(self, seed: int = None):
+        if seed is None:
+            seed = randrange(0, 2 ** 31)
 
+        self.seed = seed
+        self.stage_snapshots = {}
+
+        if self.cache_dir is not None and self.generation_dict['chunk_size'] <= 0 \
+                and worldstore.load_cached_world(self, self.cache_dir):
+            self.finish_generation()
+            return
+
+        self.run_stages(self.generation_stages[0][0])
+
+    def update_generation(self, changes: dict):
+        # apply new generation settings to the current world, replaying only the stages that read them.
+        # returns the first stage that was rerun, or None when nothing needed to change
+        self.generation_dict.update(changes)
+
+        for name, method, keys in self.generation_stages:
+            if any(k in keys for k in changes):
+                self.run_stages(name)
+                return name
+
+        return None
+
+    def run_stages(self, first: str):
+        names = [s[0] for s in self.generation_stages]
+        start = names.index(first)
+        layer_start = names.index(self.structural_stages[-1]) + 1
+
+        if start < layer_start:
+            # structural stages hand each other live objects, so anything after the voronoi diagram is rebuilt
+            # from the regions stage onwards
+            if start > names.index('regions'):
+                start = names.index('regions')
+        elif first in self.stage_snapshots:
+            self.restore_snapshot(self.stage_snapshots[first])
+        else:
+            # nothing to replay from, e.g. the world came out of the cache
+            start = 0
+
+        chunked = start >= layer_start and isinstance(self.world, ChunkedWorld)
+
+        for name, method, keys in self.generation_stages[start:]:
+            chunked = chunked or (name == 'regions' and self.generation_dict['chunk_size'] > 0)
+            if chunked and name in self.tile_stages:
+                continue
+
+            if names.index(name) >= layer_start:
+                self.stage_snapshots[name] = self.take_snapshot()
+
+            # every stage draws from its own stream, so replaying one never shifts the numbers another sees
+            self.rng.seed(f'{self.seed}:{name}')
+            with profiling.section('generation.' + name):
+                getattr(self, method)()
+
+        if isinstance(self.world, ChunkedWorld):
+            # every chunk generated so far used the old settings
+            self.world.clear()
+        elif self.cache_dir is not None:
+            worldstore.cache_world(self, self.cache_dir)
+
+        self.finish_generation()
+
+    def take_snapshot(self):
+        if isinstance(self.world, ChunkedWorld):
+            return {'layers': {}, 'terrains': [r.terrain for r in self.regions]}
+
+        return {'layers': {name: self.get_layer(name).copy() for name in layer_formats},
+                'terrains': [r.terrain for r in self.regions]}
+
+    def restore_snapshot(self, snapshot: dict):
+        for name, values in snapshot['layers'].items():
+            self.set_layer(name, values)
+
+        for r, terrain in zip(self.regions, snapshot['terrains']):
+            r.terrain = terrain
+
+    def finish_generation(self):
+        # restart the stream so that a freshly generated world and one loaded from the cache hand out the same
+        # random numbers afterwards
+        self.rng = Random(self.seed)
+
+        self.selected_tile = self.world[0][0]
+        self.mark_all_dirty()
+        self.pathfinder.clear()
+
+    # generation stages
+
+    def seed_stage(self):
+        self.seeds = []
         self.set_seeds()
 
+    def voronoi_stage(self):
         self.voronoi_diagram = spatial.Voronoi(self.seeds)
+        self.region_adjacency = self.build_region_adjacency(self.voronoi_diagram)
+
+    def region_stage(self):
         self.world = self.create_base_map(self.generation_dict['width'], self.generation_dict['height'],
                                           self.generation_dict['min_altitude'])
+        self.continents = []
 
         self.regions = self.set_world_regions(self.voronoi_diagram)
+        self.index_regions()
 
+    def continent_stage(self):
         self.regions = self.generate_continents()
+        self.index_regions()
 
         self.assign_tiles_to_regions()
         self.update_region_tiles()
 
+    def mountain_stage(self):
+        self.ridge_lines = []
         self.gen_mountain_ranges()
 
+    def noise_stage(self):
         self.world = self.apply_simplex_noise()
-        self.world = self.gaussian_smooth()
 
-        # self.set_heat_map()
-        # ;self.set_precipitation_map()
-        # self.set_tile_terrains()
+    def smoothing_stage(self):
+        self.world = self.gaussian_smooth()
 
+    def sea_stage(self):
         self.set_sea_tiles()
-
         self.truncate_tile_heights()
 
-        self.terrain_filter()
+    def climate_stage(self):
+        self.set_heat_map()
+        self.set_precipitation_map()
+        # self.set_tile_terrains()
 
-        self.selected_tile = self.world[0][0]
+    def filter_stage(self):
+        self.terrain_filter()
 
     def set_seeds(self):
         for i in range(0, self.generation_dict['seed_count']):
-            self.seeds.append([randint(0, self.generation_dict['width'] - 1), randint(0, self.generation_dict['height'] - 1)])
+            self.seeds.append([self.rng.randint(0, self.generation_dict['width'] - 1),
+                               self.rng.randint(0, self.generation_dict['height'] - 1)])
 
     def create_base_map(self, width: int, height: int, min_altitude: int):
+        if self.generation_dict['chunk_size'] > 0:
+            return ChunkedWorld(self, width, height, self.generation_dict['chunk_size'], self.chunk_cache_size,
+                                self.chunk_spill_dir)
+
+        if self.generation_dict['array_grid']:
+            return WorldGrid(width, height, min_altitude)
+
+        # one index shared by every tile of the map
+        entity_index = EntityIndex()
+
         new_map = []
         for i in range(0, height):
             new_map.append([])
             for j in range(0, width):
-                t = Tile(j, i, min_altitude)
+                t = Tile(j, i, min_altitude, entity_index)
                 new_map[i].append(t)
         return new_map
 
     def filter_valid_regions(self, vor: spatial.Voronoi):
+        return [vor.regions[i] for i in self.valid_region_indices(vor)]
+
+    def valid_region_indices(self, vor: spatial.Voronoi):
         valid_regions = []
 
-        for r in vor.regions:
+        for index, r in enumerate(vor.regions):
             region_x_vertices = []
             region_y_vertices = []
             for i in r:
@@ -225,75 +478,173 @@ class WorldMap:
 
             if -1 not in r and all(0 < i < self.generation_dict['width'] for i in region_x_vertices) \
                     and all(0 < i < self.generation_dict['height'] for i in region_y_vertices) and len(r) > 0:
-                valid_regions.append(r)
+                valid_regions.append(index)
 
         # print(valid_regions)
 
         return valid_regions
 
     def set_world_regions(self, vor: spatial.Voronoi):
-        valid_regions = self.filter_valid_regions(vor)
+        valid_regions = self.valid_region_indices(vor)
+
+        # voronoi regions are numbered independently of the points they surround
+        region_seeds = {r: p for p, r in enumerate(vor.point_region)}
 
         temp_regions = []
 
         a = 0
-        for r in valid_regions:
+        for index in valid_regions:
             t = []
             v = []
-            for i in r:
+            for i in vor.regions[index]:
                 v.append([int(s) for s in self.voronoi_diagram.vertices[i].tolist()])
 
-            reg = Region(self.region_letters[a], self.generation_dict['sea_level'] + 1,
-                         randint(self.generation_dict['sea_level'] + 1, self.generation_dict['max_altitude']),
-                         v, t)
+            reg = Region(self.region_letters[a % len(self.region_letters)], self.generation_dict['sea_level'] + 1,
+                         self.rng.randint(self.generation_dict['sea_level'] + 1, self.generation_dict['max_altitude']),
+                         v, t, region_seeds[index])
             temp_regions.append(reg)
             a += 1
 
         return temp_regions
 
+    def build_region_adjacency(self, vor: spatial.Voronoi):
+        # two cells are neighbours exactly when a voronoi ridge separates their points
+        adjacency = {p: set() for p in range(0, len(vor.points))}
+
+        for a, b in vor.ridge_points.tolist():
+            adjacency[a].add(b)
+            adjacency[b].add(a)
+
+        return adjacency
+
+    def index_regions(self):
+        self.region_index = {r.seed_index: r for r in self.regions}
+
+        # vertex bounding box of every region, in list order, so labelling a window only visits regions that reach it
+        boxes = [(min(v[0] for v in r.vertices), min(v[1] for v in r.vertices),
+                  max(v[0] for v in r.vertices), max(v[1] for v in r.vertices)) if len(r.vertices) > 0
+                 else (0, 0, -1, -1) for r in self.regions]
+        self.region_boxes = array(boxes, dtype=int).reshape(-1, 4)
+
+    def region_lookup(self, attribute: str, default, dtype=int):
+        # a region attribute by seed index, with one spare slot at the end so that tiles labelled -1 get the default
+        lookup = full(len(self.voronoi_diagram.points) + 1, default, dtype=dtype)
+        for r in self.regions:
+            lookup[r.seed_index] = getattr(r, attribute)
+
+        return lookup
+
+    def label_tiles(self, window: (int, int, int, int) = None):
+        # rasterize each region polygon over its bounding box; earlier regions win shared border tiles.
+        # tiles are labelled with the seed index of their region, -1 outside every region
+        wx, wy, width, height = self.full_window() if window is None else window
+
+        labels = full((height, width), -1)
+
+        boxes = self.region_boxes
+        reaching = flatnonzero((boxes[:, 0] < wx + width) & (boxes[:, 2] >= wx) &
+                               (boxes[:, 1] < wy + height) & (boxes[:, 3] >= wy))
+
+        for i in reaching.tolist():
+            r = self.regions[i]
+            x0 = max(boxes[i, 0], wx, 0)
+            y0 = max(boxes[i, 1], wy, 0)
+            x1 = min(boxes[i, 2] + 1, wx + width)
+            y1 = min(boxes[i, 3] + 1, wy + height)
+
+            ys, xs = mgrid[y0:y1, x0:x1]
+            inside = mplpath.Path(r.vertices).contains_points(column_stack((xs.ravel(), ys.ravel())))
+            inside = inside.reshape(ys.shape) & (labels[y0 - wy:y1 - wy, x0 - wx:x1 - wx] < 0)
+
+            labels[y0 - wy:y1 - wy, x0 - wx:x1 - wx][inside] = r.seed_index
+
+        return labels
+
+    def continent_lookup(self):
+        # one spare slot at the end so that tiles labelled -1 map to -1
+        lookup = full(len(self.voronoi_diagram.points) + 1, -1)
+        for n, c in enumerate(self.continents):
+            for r in c.regions:
+                lookup[r.seed_index] = n
+
+        return lookup
+
+    def index_continents(self):
+        if isinstance(self.world, ChunkedWorld):
+            self.continent_ids = self.world.layers['continent_ids']
+            return
+
+        self.continent_ids = self.continent_lookup()[self.region_ids]
+
     def assign_tiles_to_regions(self):
-        for i in self.world:
-            for j in i:
-                in_region = False
-                for r in self.regions:
-                    if len(r.vertices) > 0:
-                        path = mplpath.Path(r.vertices)
-
-                        if path.contains_point((j.x, j.y)):
-                            j.icon = r.icon
-                            r.tiles.append(j)
-                            in_region = True
-                            break
-                if in_region is False:
-                    j = Tile(j.x, j.y, self.generation_dict['min_altitude'])
+        if isinstance(self.world, ChunkedWorld):
+            # the region list changed, so labels cached while picking continents are stale; tiles are labelled
+            # again chunk by chunk and region tile lists stay empty
+            self.world.clear()
+            self.region_ids = self.world.layers['region_ids']
+            self.index_continents()
+            return
+
+        self.region_ids = self.label_tiles()
+        self.index_continents()
+        self.collect_region_tiles()
+
+    def collect_region_tiles(self):
+        width = self.generation_dict['width']
+
+        land = self.region_ids >= 0
+        icons = self.get_layer('icon')
+        icons[land] = self.region_lookup('icon', '~', 'U1')[self.region_ids[land]]
+        self.set_layer('icon', icons)
+
+        # walk the tiles grouped by region, in row order within each region
+        flat = self.region_ids.ravel()
+        order = flat.argsort(kind='stable')
+        bounds = flat[order].searchsorted([r.seed_index for r in self.regions] +
+                                          [r.seed_index + 1 for r in self.regions])
+
+        for i, r in enumerate(self.regions):
+            indices = order[bounds[i]:bounds[i + len(self.regions)]]
+            if isinstance(self.world, WorldGrid):
+                r.tiles.extend(self.world.tiles_at(indices))
+            else:
+                for index in indices.tolist():
+                    r.tiles.append(self.world[index // width][index % width])
 
         # self.update_region_tiles()
 
     # climate generation
 
     def set_heat_map(self):
-        noise_map = self.world
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'heat', self.tile_workers)
+            return
+
+        self.set_layer('temperature', self.heat_values(self.full_window()))
+
+    def set_precipitation_map(self):
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'precipitation', self.tile_workers)
+            return
 
+        self.set_layer('precipitation', self.precipitation_values(self.get_layer('temperature'), self.full_window()))
+
+    def heat_values(self, window: (int, int, int, int)):
+        x0, y0, width, height = window
         equator = int(self.generation_dict['height'] / 2)
         min_t = self.generation_dict['min_temp']
 
-        for i in noise_map:
-            for j in i:
-                j.temperature = int(self.generation_dict['max_temp'] - (min_t * (abs(j.y - equator) / equator))**1.1 +
-                                    int(self.generation_dict['temp_variance'] *
-                                        (noise.snoise2(j.x * self.generation_dict['heat_noise_scale'],
-                                                       j.y * self.generation_dict['heat_noise_scale']))))
+        y = mgrid[y0:y0 + height, x0:x0 + width][0]
+        variance = (self.generation_dict['temp_variance'] *
+                    self.simplex_grid(self.generation_dict['heat_noise_scale'], window=window)).astype(int)
 
-    def set_precipitation_map(self):
-        noise_map = self.world
+        return (self.generation_dict['max_temp'] - (min_t * (abs(y - equator) / equator))**1.1 + variance).astype(int)
 
-        for i in noise_map:
-            for j in i:
-                j.precipitation = int(self.generation_dict['base_precip'] + int(self.generation_dict['precip_variance'] *
-                                      noise.snoise2(j.x * self.generation_dict['precip_noise_scale'],
-                                                    j.y * self.generation_dict['precip_noise_scale'])))
-                if j.precipitation > j.temperature:
-                    j.precipitation = j.temperature
+    def precipitation_values(self, temperature: ndarray, window: (int, int, int, int)):
+        variance = (self.generation_dict['precip_variance'] *
+                    self.simplex_grid(self.generation_dict['precip_noise_scale'], window=window)).astype(int)
+
+        return minimum(self.generation_dict['base_precip'] + variance, temperature)
 
     # def set_tile_terrains(self):
         # for i in self.world:
@@ -303,11 +654,29 @@ class WorldMap:
     # updating methods
 
     def update_region_tiles(self):
-        for r in self.regions:
-            r.update_tiles()
-            for t in r.tiles:
-                t.icon = self.world[t.y][t.x].icon
-                t.height = self.world[t.y][t.x].height
+        # same as calling Region.update_tiles on every region, driven by the label array instead of the tile lists
+        if isinstance(self.world, ChunkedWorld):
+            return
+
+        land = self.region_ids >= 0
+        base_heights = self.region_lookup('base_height', 0)
+
+        types = self.get_layer('type')
+        types[land] = tile_types.index('Land')
+        self.set_layer('type', types)
+
+        heights = self.get_layer('height')
+        heights[land] = maximum(heights[land], base_heights[self.region_ids[land]])
+        self.set_layer('height', heights)
+
+    def fill_region_layers(self, layers: {str: ndarray}, region_ids: ndarray):
+        # update_region_tiles plus the region icons, for the layers of a window labelled with region_ids
+        land = region_ids >= 0
+        labels = region_ids[land]
+
+        layers['icon'][land] = self.region_lookup('icon', '~', 'U1')[labels]
+        layers['type'][land] = tile_types.index('Land')
+        layers['height'][land] = maximum(layers['height'][land], self.region_lookup('base_height', 0)[labels])
 
     def update_world_tiles(self):
         for r in self.regions:
@@ -321,6 +690,69 @@ class WorldMap:
             for r in c.regions:
                 r.update_tile_terrains()
 
+    # layer access, shared by the tile object and array grid backends
+
+    def get_layer(self, name: str):
+        if isinstance(self.world, ChunkedWorld):
+            return self.world.full_layer(name)
+
+        if isinstance(self.world, WorldGrid):
+            return self.world.layers[name]
+
+        codes = layer_codes.get(name)
+        values = [[getattr(j, name) for j in i] for i in self.world]
+        if codes is not None:
+            values = [[codes.index(v) for v in row] for row in values]
+
+        return array(values, dtype=layer_formats[name][0])
+
+    def set_layer(self, name: str, values: ndarray):
+        self.mark_all_dirty()
+        if name in ('type', 'height'):
+            self.pathfinder.clear()
+
+        if isinstance(self.world, ChunkedWorld):
+            self.world.write_layer(name, values)
+            return
+
+        if isinstance(self.world, WorldGrid):
+            self.world.layers[name][...] = values
+            return
+
+        codes = layer_codes.get(name)
+        for i, row in zip(self.world, values.tolist()):
+            for j, v in zip(i, row):
+                setattr(j, name, v if codes is None else codes[v])
+
+    def whole_layer(self, name: str):
+        # a layer of the whole map, including the region and continent id grids
+        if isinstance(self.world, ChunkedWorld):
+            return self.world.full_layer(name)
+
+        if name in ('region_ids', 'continent_ids'):
+            return getattr(self, name)
+
+        return self.get_layer(name)
+
+    def window_layer(self, name: str, window: (int, int, int, int)):
+        # a layer of the tiles in window only; a chunked world generates just the chunks the window overlaps
+        x0, y0, width, height = window
+        if isinstance(self.world, ChunkedWorld):
+            return self.world.window_layer(name, x0, y0, x0 + width, y0 + height)
+
+        return self.get_layer(name)[y0:y0 + height, x0:x0 + width]
+
+    def use_tile_workers(self):
+        return self.tile_workers > 1 and not isinstance(self.world, ChunkedWorld) \
+            and self.generation_dict['width'] * self.generation_dict['height'] >= self.parallel_min_tiles
+
+    def full_window(self):
+        return 0, 0, self.generation_dict['width'], self.generation_dict['height']
+
+    def simplex_grid(self, scale: float, octaves: int = 1, window: (int, int, int, int) = None):
+        x0, y0, width, height = self.full_window() if window is None else window
+        return noise_field(width, height, scale, octaves, (x0, y0))
+
     # a few helper methods
 
     def tile_at_point(self, x: int, y: int):
@@ -349,26 +781,14 @@ class WorldMap:
             self.tile_at_point(t.x + 1, t.y),
             self.tile_at_point(t.x + 1, t.y + 1)
         ]
-        shuffle(adjacent)
+        self.rng.shuffle(adjacent)
         return adjacent
 
     def adjacent_regions(self, r: Region):
-        adjacent = []
-
-        for s in self.regions:
-            if any(i in s.vertices for i in r.vertices):
-                adjacent.append(s)
-
-        return adjacent
+        return [self.region_index[s] for s in self.region_adjacency[r.seed_index] if s in self.region_index]
 
     def get_region_of_tile(self, t: Tile):
-        for r in self.regions:
-            if len(r.vertices) > 0:
-                path = mplpath.Path(r.vertices)
-
-                if path.contains_point((t.x, t.y)):
-                    return r
-        return None
+        return self.region_index.get(int(self.region_ids[t.y, t.x]))
 
     def get_continent_of_region(self, r: Region):
         for c in self.continents:
@@ -377,61 +797,104 @@ class WorldMap:
         return None
 
     def get_continent_of_tile(self, t: Tile):
-        for c in self.continents:
-            all_tiles = []
-            for r in c.regions:
-                for t in r.tiles:
-                    all_tiles.append(t)
-            if all_tiles.__contains__(t):
-                return c
+        n = self.continent_ids[t.y, t.x]
+        if n < 0:
+            return None
 
-        return None
+        return self.continents[n]
+
+    def get_random_land_tile(self, rng: Random = None):
+        if rng is None:
+            rng = self.rng
+
+        c = self.continents[rng.randint(0, len(self.continents) - 1)]
 
-    def get_random_land_tile(self):
-        c = self.continents[randint(0, len(self.continents) - 1)]
-        r = c.regions[randint(0, len(c.regions) - 1)]
+        if isinstance(self.world, ChunkedWorld):
+            # region tile lists are not kept for chunked worlds; labelling the region's bounding box yields the same
+            # tiles in the same row order
+            tiles = []
+            while len(tiles) <= 0:
+                r = c.regions[rng.randint(0, len(c.regions) - 1)]
+                tiles = self.region_tile_points(r)
+            x, y = tiles[rng.randint(0, len(tiles) - 1)]
+
+            return self.world[y][x]
+
+        r = c.regions[rng.randint(0, len(c.regions) - 1)]
         while len(r.tiles) <= 0:
-            r = c.regions[randint(0, len(c.regions) - 1)]
-        t = r.tiles[randint(0, len(r.tiles) - 1)]
+            r = c.regions[rng.randint(0, len(c.regions) - 1)]
+        t = r.tiles[rng.randint(0, len(r.tiles) - 1)]
 
         return t
 
+    def region_tile_points(self, r: Region):
+        x0, y0, x1, y1 = self.region_boxes[self.regions.index(r)].tolist()
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1 + 1, self.generation_dict['width']), min(y1 + 1, self.generation_dict['height'])
+        if x0 >= x1 or y0 >= y1:
+            return []
+
+        ys, xs = (self.label_tiles((x0, y0, x1 - x0, y1 - y0)) == r.seed_index).nonzero()
+        return list(zip((xs + x0).tolist(), (ys + y0).tolist()))
+
     def swap_tile_region(self, t: Tile, swap_to: Region):
         swap_from = self.get_region_of_tile(t)
         swap_from.tiles.remove(t)
         swap_to.tiles.append(t)
 
+        self.region_ids[t.y, t.x] = swap_to.seed_index
+        c = self.get_continent_of_region(swap_to)
+        self.continent_ids[t.y, t.x] = -1 if c is None else self.continents.index(c)
+
     # tile color filters
+    # each filter computes colours from a layer getter, so that a chunked world can colour chunks as they appear
+
+    def apply_color_filter(self, colors_of):
+        if isinstance(self.world, ChunkedWorld):
+            self.world.set_color_filter(None if colors_of == self.terrain_colors else colors_of)
+            self.mark_all_dirty()
+            return
+
+        self.set_layer('color', colors_of(self.whole_layer))
+
     def continent_filter(self):
-        for c in self.continents:
-            all_tiles = []
-            for r in c.regions:
-                for t in r.tiles:
-                    t.color = c.color
+        self.apply_color_filter(self.continent_colors)
 
     def heat_filter(self):
-        temperature_colors = [15, 195, 87, 86, 84, 46, 40, 190, 226, 184, 178]
-
-        for i in self.world:
-            for j in i:
-                if j.type is 'Land':
-                    j.color = temperature_colors[j.temperature]
+        self.apply_color_filter(self.heat_colors)
 
     def rain_filter(self):
-        precipitation_colors = [224, 222, 227, 190, 119, 120, 48, 46, 34, 28, 22]
+        self.apply_color_filter(self.rain_colors)
 
-        for i in self.world:
-            for j in i:
-                if j.type is 'Land':
-                    j.color = precipitation_colors[j.precipitation]
+    def continent_colors(self, layer):
+        continent_ids = layer('continent_ids')
+        owned = continent_ids >= 0
+
+        colors = layer('color')
+        colors[owned] = array([c.color for c in self.continents], dtype=int)[continent_ids[owned]]
+        return colors
+
+    def heat_colors(self, layer):
+        land = layer('type') == tile_types.index('Land')
+
+        colors = layer('color')
+        colors[land] = array(temperature_colors)[layer('temperature')[land]]
+        return colors
+
+    def rain_colors(self, layer):
+        land = layer('type') == tile_types.index('Land')
+
+        colors = layer('color')
+        colors[land] = array(precipitation_colors)[layer('precipitation')[land]]
+        return colors
 
     def get_terrain_color(self, tile):
-        forest_colors = [23, 29, 22, 28, 34, 40, 46, 47, 48]
-        ocean_colors = [17, 18, 19, 20, 21, 33, 45, 201, 201, 201]
-        mountain_colors = [201, 201, 201, 233, 235, 237, 241, 248, 252, 255]
-        desert_colors = [3, 186, 190, 226, 227, 228, 229, 230, 252, 255]
-        rainforest_colors = [24, 30, 36, 35, 41, 47, 83, 77]
-        frozen_colors = [63, 69, 75, 81, 87, 253, 255]
+        forest_colors = terrain_colors['Forest']
+        ocean_colors = terrain_colors['Ocean']
+        mountain_colors = terrain_colors['Mountain']
+        desert_colors = terrain_colors['Desert']
+        rainforest_colors = terrain_colors['Rainforest']
+        frozen_colors = terrain_colors['Frozen']
 
         color_table = [201, 201, 201, 201, 201, 201, 201, 201, 201]
 
@@ -453,53 +916,71 @@ class WorldMap:
         return color_table[tile.height]
 
     def terrain_filter(self):
-        for i in self.world:
-            for j in i:
-                j.color = self.get_terrain_color(j)
+        self.apply_color_filter(self.terrain_colors)
+
+    def terrain_colors(self, layer):
+        # vectorized get_terrain_color; short color tables are padded with the same 201 used for unknown terrain
+        order = ['Forest', 'Ocean', 'Mountain', 'Desert', 'Rainforest', 'Frozen']
+        tables = array([terrain_colors[k] + [201] * (10 - len(terrain_colors[k])) for k in order])
+
+        types = layer('type')
+        terrains = layer('terrain')
+        heights = layer('height')
+
+        kind = select([types != tile_types.index('Land'),
+                       heights >= 6,
+                       terrains == terrain_types.index('Desert'),
+                       terrains == terrain_types.index('Rainforest'),
+                       terrains == terrain_types.index('Frozen')],
+                      [1, 2, 3, 4, 5], 0)
+
+        return tables[kind, clip(heights, 0, tables.shape[1] - 1)]
 
     # region modification
 
     def get_seed_regions(self):
-        temp_regions = copy.deepcopy(self.regions)
+        # regions are tracked by their position in self.regions; picking a region excludes it and its neighbours,
+        # and with seed_region_spacing set, candidates whose centre is closer than that to a picked seed are skipped
+        position = {r.seed_index: n for n, r in enumerate(self.regions)}
+        excluded = zeros(len(self.regions), dtype=bool)
+        centers = array([r.get_region_center() for r in self.regions], dtype=float).reshape(-1, 2)
+        spacing = self.generation_dict['seed_region_spacing']
         seed_regions = []
 
+        def pick(n: int):
+            r = self.regions[n]
+            seed_regions.append(r)
+            excluded[n] = True
+            for a in self.adjacent_regions(r):
+                excluded[position[a.seed_index]] = True
+
         # pick initial region
-        picked_region = False
-        while picked_region is False:
-            i = self.world[randint(0, self.generation_dict['height'] - 1)][randint(0, self.generation_dict['width'] - 1)]
+        while len(seed_regions) == 0:
+            i = self.world[self.rng.randint(0, self.generation_dict['height'] - 1)][
+                self.rng.randint(0, self.generation_dict['width'] - 1)]
             r = self.get_region_of_tile(i)
 
             if r is not None:
-                picked_region = True
-                seed_regions.append(r)
-
-                for t in temp_regions:
-                    if t.icon is r.icon:
-                        temp_regions.remove(t)
-                        break
+                pick(position[r.seed_index])
 
-                for a in self.adjacent_regions(r):
-                    for t in temp_regions:
-                        if t.icon is a.icon:
-                            temp_regions.remove(t)
-                            break
+        # the candidate list keeps its shuffled order from one pick to the next
+        candidates = flatnonzero(~excluded).tolist()
 
         while len(seed_regions) < self.generation_dict['continent_count']:
-            shuffle(temp_regions)
-            r = temp_regions[0]
+            self.rng.shuffle(candidates)
 
-            seed_regions.append(r)
+            allowed = candidates
+            if spacing > 0 and len(candidates) > 0:
+                picked = array([position[s.seed_index] for s in seed_regions])
+                gaps = hypot_array(*(centers[candidates, None, :] - centers[None, picked, :]).transpose(2, 0, 1))
+                allowed = [c for c, gap in zip(candidates, gaps.min(axis=1).tolist()) if gap >= spacing]
 
-            for t in temp_regions:
-                if t.icon is r.icon:
-                    temp_regions.remove(t)
-                    break
+            if len(allowed) == 0:
+                # the map cannot fit any more seeds under these constraints
+                break
 
-            for a in self.adjacent_regions(r):
-                for t in temp_regions:
-                    if t.icon is a.icon:
-                        temp_regions.remove(t)
-                        break
+            pick(allowed[0])
+            candidates = [c for c in candidates if not excluded[c]]
 
         for s in seed_regions:
             for t in s.tiles:
@@ -507,46 +988,56 @@ class WorldMap:
 
         return seed_regions
 
+    def claim_region(self, r: Region, continent: int, owner: [int], borders: [int]):
+        owner[r.seed_index] = continent
+        for s in self.region_adjacency[r.seed_index]:
+            borders[s] |= 1 << continent
+
     def generate_continents(self):
         total_regions = []
+
+        # seed picking looks regions up by tile, so label the grid with every valid region first
+        if isinstance(self.world, ChunkedWorld):
+            self.region_ids = self.world.layers['region_ids']
+        else:
+            self.region_ids = self.label_tiles()
         seed_regions = self.get_seed_regions()
 
-        for r in seed_regions:
-            self.continents.append(Continent([r], r.icon, randint(0, 256)))
+        # owner holds the continent number of every claimed region, borders a bitmask of the continents owning a
+        # neighbouring region; a region may only join continent n while no other continent borders it
+        owner = [-1] * len(self.voronoi_diagram.points)
+        borders = [0] * len(self.voronoi_diagram.points)
+        frontiers = []
+
+        for n, r in enumerate(seed_regions):
+            self.continents.append(Continent([r], r.icon, self.rng.randint(0, 256)))
+            self.claim_region(r, n, owner, borders)
+            frontiers.append(deque([r]))
             total_regions.append(r)
 
         region_quota = int(len(self.regions) * (self.generation_dict['percent_land'] / 100))
+        order = list(range(0, len(self.continents)))
 
-        while len(total_regions) < region_quota:
-            shuffle(self.continents)
-
-            for c in self.continents:
-                append_to_c = []
+        # grow every continent by one ring of regions per pass, stopping early once no frontier has anything left
+        while len(total_regions) < region_quota and any(frontiers):
+            self.rng.shuffle(order)
 
-                for r in c.regions:
-                    adjacent = self.adjacent_regions(r)
-                    temp = adjacent
+            for n in order:
+                c = self.continents[n]
+                frontier = frontiers[n]
 
-                    invalid_regions = []
-                    for d in self.continents:
-                        if d is not c:
-                            adjacent_to_continent = []
-                            for s in d.regions:
-                                adjacent_to_continent += self.adjacent_regions(s)
-                            invalid_regions += adjacent_to_continent
+                for i in range(0, len(frontier)):
+                    r = frontier.popleft()
 
-                    for a in temp:
-                        if invalid_regions.__contains__(a):
-                            adjacent.remove(a)
-
-                    for a in adjacent:
-                        if len(total_regions) < region_quota and not total_regions.__contains__(a) \
-                                and not append_to_c.__contains__(a):
+                    for a in self.adjacent_regions(r):
+                        if len(total_regions) < region_quota and owner[a.seed_index] < 0 \
+                                and borders[a.seed_index] & ~(1 << n) == 0:
+                            self.claim_region(a, n, owner, borders)
+                            c.regions.append(a)
                             total_regions.append(a)
-                            append_to_c.append(a)
-                            # print(len(total_regions))
+                            frontier.append(a)
 
-                c.regions += append_to_c
+        self.index_continents()
 
         return total_regions
 
@@ -555,7 +1046,7 @@ class WorldMap:
 
         for i in range(0, self.generation_dict['mountains_per_continent']):
             range_lines = []
-            i = randint(0, len(continent.regions) - 1)
+            i = self.rng.randint(0, len(continent.regions) - 1)
             continent.regions[i].terrain = 'Mountain'
             t = continent.regions[i]
             generated_regions.append(t)
@@ -564,7 +1055,7 @@ class WorldMap:
 
             for j in range(0, self.generation_dict['mountain_range_length']):
                 adjacent = self.adjacent_regions(t)
-                shuffle(adjacent)
+                self.rng.shuffle(adjacent)
                 for r in generated_regions:
                     if adjacent.__contains__(r):
                         adjacent.remove(r)
@@ -579,64 +1070,110 @@ class WorldMap:
 
             # print(range_lines)
 
-            for k in self.world:
-                for l in k:
-                    for m in range_lines:
-                        if self.is_between(m[0], (l.x, l.y), m[1]):
-                            l.height = self.generation_dict['max_altitude']
+            self.raise_ridges(range_lines)
+
+    def raise_ridges(self, range_lines: [((int, int), (int, int))]):
+        # the lines are kept so that a chunked world can raise the same ridges chunk by chunk
+        self.ridge_lines.append(range_lines)
+
+        if not isinstance(self.world, ChunkedWorld):
+            self.set_layer('height', self.ridge_heights(self.get_layer('height'), self.full_window(), range_lines))
+
+    def ridge_heights(self, heights: ndarray, window: (int, int, int, int), range_lines: [((int, int), (int, int))]):
+        # tiles within half of mountain_width of a range line reach max_altitude, then the lift fades out linearly
+        # over the next mountain_falloff tiles; only the bounding box around each line is ever touched
+        wx, wy, width, height = window
+        half_width = self.generation_dict['mountain_width'] / 2
+        falloff = self.generation_dict['mountain_falloff']
+        reach = half_width + falloff
+
+        lift = zeros((height, width))
+
+        for a, b in range_lines:
+            x0 = max(int(min(a[0], b[0]) - reach), 0, wx)
+            x1 = min(int(max(a[0], b[0]) + reach) + 1, wx + width)
+            y0 = max(int(min(a[1], b[1]) - reach), 0, wy)
+            y1 = min(int(max(a[1], b[1]) + reach) + 1, wy + height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+
+            ys, xs = mgrid[y0:y1, x0:x1]
+            d = segment_distance(xs, ys, a, b) - half_width
+
+            if falloff > 0:
+                weight = clip(1 - d / falloff, 0, 1)
+            else:
+                weight = (d <= 0).astype(float)
+            weight[d <= 0] = 1
+
+            lift[y0 - wy:y1 - wy, x0 - wx:x1 - wx] = maximum(lift[y0 - wy:y1 - wy, x0 - wx:x1 - wx], weight)
+
+        peak = self.generation_dict['max_altitude']
+        raised = heights + rint((peak - heights) * lift).astype(int)
+        return maximum(heights, raised)
 
     def gen_mountain_ranges(self):
         for c in self.continents:
             self.set_continent_mountain_ranges(c)
 
     def set_sea_tiles(self):
-        for i in self.world:
-            for j in i:
-                if j.type != 'Land':
-                    j.type = 'Sea'
-                    if j.height > self.generation_dict['sea_level']:
-                        j.height = self.generation_dict['sea_level']
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'sea', self.tile_workers)
+            return
+
+        types, heights = self.sea_layers(self.get_layer('type'), self.get_layer('height'))
+
+        self.set_layer('type', types)
+        self.set_layer('height', heights)
+
+    def sea_layers(self, types: ndarray, heights: ndarray):
+        sea = types != tile_types.index('Land')
+        types[sea] = tile_types.index('Sea')
+        heights[sea] = minimum(heights[sea], self.generation_dict['sea_level'])
+
+        return types, heights
 
     def truncate_tile_heights(self):
-        for i in self.world:
-            for j in i:
-                if j.height > self.generation_dict['max_altitude']:
-                    j.height = self.generation_dict['max_altitude']
-                elif j.height < self.generation_dict['min_altitude']:
-                    j.height = self.generation_dict['min_altitude']
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'truncate', self.tile_workers)
+            return
+
+        self.set_layer('height', self.truncated_heights(self.get_layer('height')))
+
+    def truncated_heights(self, heights: ndarray):
+        return clip(heights, self.generation_dict['min_altitude'], self.generation_dict['max_altitude'])
 
     def gaussian_smooth(self):
-        blur_world = self.world
-        height_map = []
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'smoothing', self.tile_workers)
+            return self.world
 
-        for i in blur_world:
-            height_map.append([])
-            for j in i:
-                height_map[-1].append(j.height)
+        self.set_layer('height', self.smooth_heights(self.get_layer('height')))
 
-        blurred = gaussian_filter(array(height_map), sigma=0.5)
+        return self.world
 
-        y_index = 0
-        for i in blurred:
-            x_index = 0
-            for j in i:
-                blur_world[y_index][x_index].height = j
-                x_index += 1
-            y_index += 1
+    def smooth_heights(self, heights: ndarray):
+        return gaussian_filter(heights, sigma=self.smoothing_sigma)
 
-        return blur_world
+    def smoothing_halo(self):
+        # reach of the smoothing kernel in tiles, with gaussian_filter's default truncation at 4 sigma
+        return int(4.0 * self.smoothing_sigma + 0.5)
 
     def apply_simplex_noise(self):
-        noise_map = self.world
+        if self.use_tile_workers():
+            tiledexec.run_step(self, 'noise', self.tile_workers)
+            return self.world
 
-        for i in noise_map:
-            for j in i:
-                j.height += int(
-                    self.generation_dict['noise_weight'] *
-                    (noise.snoise2(j.x * self.generation_dict['noise_scale'],
-                                   j.y * self.generation_dict['noise_scale'])))
+        self.set_layer('height', self.noise_heights(self.get_layer('height'), self.full_window()))
+
+        return self.world
+
+    def noise_heights(self, heights: ndarray, window: (int, int, int, int)):
+        offsets = self.generation_dict['noise_weight'] * self.simplex_grid(self.generation_dict['noise_scale'],
+                                                                           self.generation_dict['noise_octaves'],
+                                                                           window)
 
-        return noise_map
+        return heights + offsets.astype(int)
 
     # entity manipulation
 
@@ -645,26 +1182,60 @@ class WorldMap:
         self.anchor = location
 
         self.selected_entity = entity
+        self.movement_range = set(self.reachable_tiles(location, entity))
+        self.dirty_tiles.update(self.movement_range)
 
     def end_movement(self):
         self.move_entity(self.selected_entity, self.anchor, self.selected_tile)
+        self.cancel_movement()
+
+    def cancel_movement(self):
         self.is_anchored = False
+        self.dirty_tiles.update(self.movement_range)
+        self.movement_range = set()
+
+    def movement_left(self, entity):
+        return max(entity.data.get('move_distance', 0) - getattr(entity, 'used_movement', 0), 0)
+
+    def reachable_tiles(self, location, entity):
+        # cheapest path cost to every tile the entity can get to with the movement it has left this turn
+        return self.pathfinder.reachable((location.x, location.y), entity.data.get('terrain'),
+                                         self.movement_left(entity))
 
     def move_entity(self, entity, origin, destination):
-        if origin.entities.__contains__(entity) and entity.used_movement < entity.data['move_distance']:
-            origin.entities.remove(entity)
-            destination.entities.append(entity)
+        if origin.entities.__contains__(entity) and self.movement_left(entity) > 0:
+            path = self.pathfinder.find_path((origin.x, origin.y), (destination.x, destination.y),
+                                             entity.data['terrain'], self.movement_left(entity))
+            if path is None:
+                return False
+
+            self.entity_index.move(entity, (origin.x, origin.y), (destination.x, destination.y))
             entity.location = destination
-            entity.used_movement += ceil(self.distance((origin.x, origin.y), (destination.x, destination.y)))
+            # movement points are whole numbers; the tolerance keeps float sums like 2.0000000001 from rounding up
+            entity.used_movement += ceil(path[0] - 1e-9)
+            self.mark_dirty(origin)
+            self.mark_dirty(destination)
             return True
 
         return False
 
+    @property
+    def entity_index(self):
+        # every tile of a map shares the same index
+        return self.world[0][0].entity_index
+
+    def entity_tiles(self, window: (int, int, int, int) = None):
+        # tiles holding at least one entity, only those in window when one is given
+        if window is None:
+            return [self.world[y][x] for x, y in self.entity_index.positions()]
+
+        x0, y0, width, height = window
+        return [self.world[y][x] for x, y in self.entity_index.positions_in_rect(x0, y0, x0 + width, y0 + height)]
+
     def reconcile_entity_locations(self):
-        for i in self.world:
-            for j in i:
-                for e in j.entities:
-                    e.location = j
+        for (x, y), tile_entities in self.entity_index.items():
+            for e in tile_entities:
+                e.location = self.world[y][x]
 
     # printing methods
 
@@ -0,0 +1,137 @@
+from numpy import full
+from entityindex import EntityIndex
+
+
+# string attributes are stored as small integer codes; decoding hands back these exact objects so that
+# comparisons like `tile.type is 'Land'` keep working
+tile_types = ['Void', 'Land', 'Sea']
+terrain_types = ['Void', 'None', 'Desert', 'Coast', 'Mountain', 'Forest', 'Rainforest', 'Frozen', 'Barren']
+
+# name: (dtype, default) -- defaults mirror the class attributes of voromap.Tile
+layer_formats = {'height': ('i2', 0),
+                 'type': ('u1', 0),
+                 'terrain': ('u1', 0),
+                 'color': ('i2', 15),
+                 'temperature': ('i1', 0),
+                 'precipitation': ('i1', 0),
+                 'icon': ('U1', '~')}
+
+layer_codes = {'type': tile_types, 'terrain': terrain_types}
+
+
+def encode(name: str, value):
+    if name in layer_codes:
+        return layer_codes[name].index(value)
+    return value
+
+
+def decode(name: str, value):
+    if name in layer_codes:
+        return layer_codes[name][value]
+    return value.item()
+
+
+def layer_property(name: str):
+    def getter(self):
+        return decode(name, self.grid.layers[name][self.y, self.x])
+
+    def setter(self, value):
+        self.grid.layers[name][self.y, self.x] = encode(name, value)
+
+    return property(getter, setter)
+
+
+class GridTile:
+    __slots__ = ('grid', 'x', 'y')
+
+    height = layer_property('height')
+    type = layer_property('type')
+    terrain = layer_property('terrain')
+    color = layer_property('color')
+    temperature = layer_property('temperature')
+    precipitation = layer_property('precipitation')
+    icon = layer_property('icon')
+
+    def __init__(self, grid, x: int, y: int):
+        self.grid = grid
+        self.x = x
+        self.y = y
+
+    @property
+    def entity_index(self):
+        return self.grid.entity_index
+
+    @property
+    def entities(self):
+        return self.grid.entity_index.at(self.x, self.y)
+
+    def __eq__(self, other):
+        return isinstance(other, GridTile) and self.grid is other.grid and self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+
+class GridRow:
+    __slots__ = ('grid', 'y')
+
+    def __init__(self, grid, y: int):
+        self.grid = grid
+        self.y = y
+
+    def __len__(self):
+        return self.grid.width
+
+    def __getitem__(self, x: int):
+        if x < 0:
+            x += self.grid.width
+        if not 0 <= x < self.grid.width:
+            raise IndexError('tile index out of range')
+
+        return GridTile(self.grid, x, self.y)
+
+    def __iter__(self):
+        for x in range(0, self.grid.width):
+            yield GridTile(self.grid, x, self.y)
+
+
+class WorldGrid:
+    def __init__(self, width: int, height: int, min_altitude: int):
+        self.width = width
+        self.height = height
+
+        self.layers = {}
+        for name, (dtype, default) in layer_formats.items():
+            self.layers[name] = full((height, width), default, dtype=dtype)
+        self.layers['height'][:] = min_altitude
+
+        self.entity_index = EntityIndex()
+
+    def __len__(self):
+        return self.height
+
+    def adopt_layer(self, name: str, values):
+        # takes the array itself when it already has the layer's shape and dtype, e.g. a memory mapped saved grid,
+        # instead of copying it into the default one
+        layer = self.layers[name]
+        if values.shape == layer.shape and values.dtype == layer.dtype:
+            self.layers[name] = values
+        else:
+            layer[...] = values
+
+    def __getitem__(self, y: int):
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError('row index out of range')
+
+        return GridRow(self, y)
+
+    def __iter__(self):
+        for y in range(0, self.height):
+            yield GridRow(self, y)
+
+    def tiles_at(self, indices):
+        # tiles for an array of flat (row major) indices, without going through the rows
+        ys, xs = divmod(indices, self.width)
+        return [GridTile(self, x, y) for x, y in zip(xs.tolist(), ys.tolist())]
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+from zipfile import BadZipFile
+from scipy import spatial
+from numpy import array
+from numpy import cumsum
+from numpy import load
+from numpy import savez_compressed
+import voromap
+from chunkworld import ChunkedWorld
+from worldgrid import WorldGrid
+from worldgrid import layer_formats
+
+
+# bump whenever generation changes in a way that makes previously cached worlds stale
+cache_version = 2
+
+# cached worlds kept per cache directory; the least recently used ones go first
+cache_size = 64
+
+# generation settings that do not change what a world looks like
+ignored_generation_keys = ['array_grid']
+
+
+def world_key(generation_dict: dict, seed: int):
+    settings = {k: v for k, v in generation_dict.items() if k not in ignored_generation_keys}
+    text = json.dumps([cache_version, seed, settings], sort_keys=True)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def world_arrays(world_map):
+    # everything needed to rebuild a generated WorldMap, as flat arrays
+    if isinstance(world_map.world, ChunkedWorld):
+        raise ValueError('chunked worlds are generated on demand and cannot be stored')
+
+    arrays = {'generation': array(json.dumps(world_map.generation_dict, sort_keys=True)),
+              'seed': array(world_map.seed),
+              'seeds': array(world_map.seeds).reshape(-1, 2),
+              'region_ids': world_map.region_ids,
+              'continent_ids': world_map.continent_ids}
+
+    for name in layer_formats:
+        arrays['layer_' + name] = world_map.get_layer(name)
+
+    regions = world_map.regions
+    continent_of = {}
+    for n, c in enumerate(world_map.continents):
+        for r in c.regions:
+            continent_of[r.seed_index] = n
+
+    arrays['region_seed'] = array([r.seed_index for r in regions], dtype=int)
+    arrays['region_icon'] = array([r.icon for r in regions], dtype='U1')
+    arrays['region_base_height'] = array([r.base_height for r in regions], dtype=int)
+    arrays['region_max_height'] = array([r.max_height for r in regions], dtype=int)
+    arrays['region_terrain'] = array([r.terrain for r in regions], dtype='U16')
+    arrays['region_continent'] = array([continent_of.get(r.seed_index, -1) for r in regions], dtype=int)
+    arrays['region_vertex_count'] = array([len(r.vertices) for r in regions], dtype=int)
+    arrays['region_vertices'] = array([v for r in regions for v in r.vertices], dtype=int).reshape(-1, 2)
+
+    arrays['continent_icon'] = array([c.icon for c in world_map.continents], dtype='U1')
+    arrays['continent_color'] = array([c.color for c in world_map.continents], dtype=int)
+
+    return arrays
+
+
+def restore_world(world_map, arrays):
+    world_map.generation_dict.update(json.loads(str(arrays['generation'])))
+    world_map.seed = int(arrays['seed'])
+    world_map.seeds = arrays['seeds'].tolist()
+
+    world_map.voronoi_diagram = spatial.Voronoi(world_map.seeds)
+    world_map.region_adjacency = world_map.build_region_adjacency(world_map.voronoi_diagram)
+
+    world_map.world = world_map.create_base_map(world_map.generation_dict['width'],
+                                                world_map.generation_dict['height'],
+                                                world_map.generation_dict['min_altitude'])
+    for name in layer_formats:
+        if isinstance(world_map.world, WorldGrid):
+            world_map.world.adopt_layer(name, arrays['layer_' + name])
+        else:
+            world_map.set_layer(name, arrays['layer_' + name])
+
+    counts = arrays['region_vertex_count']
+    ends = cumsum(counts)
+    vertices = arrays['region_vertices'].tolist()
+
+    world_map.regions = []
+    for i in range(0, len(counts)):
+        r = voromap.Region(str(arrays['region_icon'][i]), int(arrays['region_base_height'][i]),
+                           int(arrays['region_max_height'][i]), vertices[ends[i] - counts[i]:ends[i]], [],
+                           int(arrays['region_seed'][i]))
+        r.terrain = str(arrays['region_terrain'][i])
+        world_map.regions.append(r)
+    world_map.index_regions()
+
+    world_map.continents = [voromap.Continent([], str(icon), int(color))
+                            for icon, color in zip(arrays['continent_icon'], arrays['continent_color'])]
+    for r, n in zip(world_map.regions, arrays['region_continent'].tolist()):
+        if n >= 0:
+            world_map.continents[n].regions.append(r)
+
+    # the id grids are kept as they come; loaded saves hand in copy on write maps, so edits never reach the file
+    world_map.region_ids = arrays['region_ids']
+    world_map.continent_ids = arrays['continent_ids']
+    world_map.collect_region_tiles()
+
+
+def cached_world_path(cache_dir: str, generation_dict: dict, seed: int):
+    return os.path.join(cache_dir, world_key(generation_dict, seed) + '.npz')
+
+
+def load_cached_world(world_map, cache_dir: str):
+    path = cached_world_path(cache_dir, world_map.generation_dict, world_map.seed)
+    if not os.path.exists(path):
+        return False
+
+    try:
+        with load(path) as bundle:
+            restore_world(world_map, {name: bundle[name] for name in bundle.files})
+        # a hit counts as a use, so pruning keeps worlds that are loaded often
+        os.utime(path)
+    except (OSError, EOFError, ValueError, KeyError, BadZipFile):
+        return False
+
+    return True
+
+
+def save_world(world_map, path: str):
+    # write next to the target and rename, so a half written file is never picked up
+    temp_path = path[:-len('.npz')] + f'.{os.getpid()}.tmp.npz'
+    savez_compressed(temp_path, **world_arrays(world_map))
+    os.replace(temp_path, path)
+
+
+def cache_world(world_map, cache_dir: str):
+    path = cached_world_path(cache_dir, world_map.generation_dict, world_map.seed)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_world(world_map, path)
+        prune_cache(cache_dir)
+    except OSError:
+        return False
+
+    return True
+
+
+def prune_cache(cache_dir: str):
+    # drop the least recently used worlds beyond cache_size
+    paths = [os.path.join(cache_dir, n) for n in os.listdir(cache_dir) if n.endswith('.npz') and '.tmp' not in n]
+    paths.sort(key=os.path.getmtime, reverse=True)
+
+    for path in paths[cache_size:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass